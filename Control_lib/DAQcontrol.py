@@ -4,21 +4,27 @@ Created on Wed Sep 23 16:39:17 2020
 
 @author: akperuht
 """
+import sys
+import ctypes
 import numpy as np
-import matplotlib.pyplot as plt
 import nidaqmx
-from nidaqmx.constants import AcquisitionType ,LoggingMode, LoggingOperation, WaitMode
+from nidaqmx.constants import AcquisitionType ,LoggingMode, LoggingOperation, WaitMode, ReadRelativeTo
 from nidaqmx.stream_readers import AnalogMultiChannelReader
-from nidaqmx.stream_writers import AnalogMultiChannelWriter
+from nidaqmx.stream_writers import AnalogSingleChannelWriter
 import threading 
+from array import array
 import multiprocessing as mp
 from queue import Queue, Empty
 import time
-import multiprocessing as mp
 from time import perf_counter
+try:
+    from .NiDAQmx_control import SharedBlockRing
+except ImportError:
+    # Imported as top level module when Control_lib is on sys.path
+    from NiDAQmx_control import SharedBlockRing
 
 class DAQcontrol():
-    def __init__(self,channels=None):
+    def __init__(self,channels=None,ring_depth=16,batch=1):
         '''
         class constructor
 
@@ -26,12 +32,18 @@ class DAQcontrol():
         ----------
         channels : list(string), optional
             DAQ channels from which data is to be collected. The default is None.
+        ring_depth : int, optional
+            Number of blocks in the shared memory ring made by make_ring. The default is 16.
+        batch : int, optional
+            Number of Nsamples chunks that continous_Nread collects into one queue message. The default is 1.
         Returns
         -------
         None.
 
         '''
         self.channels=channels
+        # Channels joined to one DAQmx channel expression, e.g. "Dev1/ai1,Dev1/ai2"
+        self._chan_expr = ",".join(channels) if channels else None
         self.data = []
         self.numpoints = 0
         self.maxpoints = np.inf
@@ -40,6 +52,41 @@ class DAQcontrol():
         self.lock = False
         self.task = None
         self.write_task = None
+        # Open analog output tasks and writers, key is channel name
+        self._ao_tasks = {}
+        self.ring_depth = ring_depth
+        self.batch = batch
+        # Data type of the buffers passed to consumers. DAQmx reads float64, 
+        # which is converted when data is copied to the buffers
+        self.dtype = np.float32
+        # Single producer single consumer ring used by collect_data
+        self._ring = None
+        self._ring_head = array('Q',[0])
+        self._ring_tail = array('Q',[0])
+        self._ring_ready = threading.Event()
+        self._ring_space = threading.Event()
+        # Random number generator for testing without hardware
+        self._rng = np.random.default_rng()
+    
+    def make_ring(self, Nsamples):
+        '''
+        Creates shared memory ring for continous_Nread. Call this in the 
+        parent process before starting the acquisition process and pass the
+        ring to it. Consumer reads the ring with get and task_done and frees
+        it with release.
+
+        Parameters
+        ----------
+        Nsamples : int
+            amount of samples in one chunk, one block holds batch chunks
+
+        Returns
+        -------
+        SharedBlockRing
+            ring_depth blocks of dtype, shape = Nchannel x (batch*Nsamples)
+
+        '''
+        return SharedBlockRing((len(self.channels), self.batch*Nsamples), self.ring_depth, self.dtype)
     
     def Stop(self):
         '''
@@ -55,8 +102,8 @@ class DAQcontrol():
     def log_data(self, sample_rate, N_samples,filename):       
         # Start task 
         with nidaqmx.Task() as task:
-            for ch in self.channels:
-                task.ai_channels.add_ai_voltage_chan(ch,min_val=self.range[0], max_val=self.range[1])
+            # Add all channels with one call using channel expression
+            task.ai_channels.add_ai_voltage_chan(self._chan_expr,min_val=self.range[0], max_val=self.range[1])
             # Set up the logging to a file
             task.in_stream.configure_logging(filename,logging_mode=LoggingMode.LOG,group_name='voltage',operation=LoggingOperation.OPEN_OR_CREATE )
             # Setting the rate of the Sample Clock and the number of samples to acquire
@@ -66,14 +113,14 @@ class DAQcontrol():
             time.sleep(5)
             task.stop()
        
-    def collect_data(self, q, sample_rate, N_samples):
+    def collect_data(self, sample_rate, N_samples):
         '''
-        Function to set up continuous collection of data using NI-DAQmx interface
+        Function to set up continuous collection of data using NI-DAQmx interface.
+        Data is written to lock-free ring buffer which is read from other thread 
+        with read_collected() and release_collected()
 
         Parameters
         ----------
-        q : queue
-            Queue where to update the data
         sample_rate : float
             Specifies the sampling rate in samples per channel per second
         N_samples : int
@@ -83,36 +130,138 @@ class DAQcontrol():
         -------
         None.
         '''
-        
-        # Initialize array for data reader
-        out=np.empty(shape=(len(self.channels),N_samples))
+        nchan = len(self.channels)
+        vmin, vmax = self.range
+        # Initialize ring of buffers for data reader, consumer can hold buffers while next one is filled
+        D = self.ring_depth
+        self._ring=[np.empty(shape=(nchan,N_samples),dtype=self.dtype) for _ in range(D)]
+        # DAQmx reads only float64, so data is read here first
+        scratch=np.empty(shape=(nchan,N_samples))
+        self._ring_head[0] = 0
+        self._ring_tail[0] = 0
+        self._ring_ready.clear()
         # Start task 
         with nidaqmx.Task() as task:
-            for ch in self.channels:
-                task.ai_channels.add_ai_voltage_chan(ch,min_val=self.range[0], max_val=self.range[1])
+            # Add all channels with one call using channel expression
+            task.ai_channels.add_ai_voltage_chan(self._chan_expr,min_val=vmin, max_val=vmax)
             # Setting the rate of the Sample Clock and the number of samples to acquire
             task.timing.cfg_samp_clk_timing(sample_rate, source="", sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan=N_samples)
             # Initializing new stream reader for the task
             self.reader = AnalogMultiChannelReader(task.in_stream)
+            # Keep track how many points are read in local variable and precompute last point
+            numpoints = self.numpoints
+            last = int(self.maxpoints) if self.maxpoints != np.inf else 2**63
             try:
-                # Perform reading
-                while not self.stop:
-                    self.numpoints+=1 # Keep track how many points are read
-                    # Read datapoints from DAQ to out array
-                    self.reader.read_many_sample(data = out,number_of_samples_per_channel = N_samples)
-                    # Update data to queue
-                    q.put((out))
-                    # Check is maximum number of points is reached
-                    if self.numpoints>self.maxpoints or self.stop:
+                # Perform reading until maximum number of points is reached
+                for numpoints in range(numpoints+1,last+2):
+                    if self.stop:
                         break
+                    # Wait for the consumer if all buffers are in use
+                    while self._ring_head[0]-self._ring_tail[0] >= D and not self.stop:
+                        self._ring_space.clear()
+                        if self._ring_head[0]-self._ring_tail[0] < D:
+                            break
+                        self._ring_space.wait(0.1)
+                    # Stop may end the wait while ring is still full, then the slot 
+                    # at head is the one consumer holds and must not be written
+                    if self.stop or self._ring_head[0]-self._ring_tail[0] >= D:
+                        break
+                    # Read datapoints from DAQ and convert them to ring buffer
+                    self.reader.read_many_sample(data = scratch,number_of_samples_per_channel = N_samples)
+                    np.copyto(self._ring[self._ring_head[0] % D],scratch,casting='same_kind')
+                    # Publish buffer, writes to single array item are atomic under the GIL
+                    self._ring_head[0] += 1
+                    # Wake up consumer only when ring turns from empty to nonempty
+                    if self._ring_head[0]-self._ring_tail[0] == 1:
+                        self._ring_ready.set()
             finally:
+                self.numpoints = numpoints
                 try:
                     task.close()
                 except:
                     pass
                 
                 
-    def continous_Nread(self,stop_event,q,sample_rate, Nsamples):
+    def read_collected(self, timeout=None):
+        '''
+        Returns oldest unread buffer written by collect_data. Buffer is valid 
+        until release_collected() is called.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum waiting time in seconds. The default is None, wait forever.
+
+        Returns
+        -------
+        array or None
+            data, shape = Nchannel x N_samples, None if timeout expired
+
+        '''
+        if self._ring_head[0] == self._ring_tail[0]:
+            self._ring_ready.clear()
+            # Check again after clearing so that wakeup from producer is not lost
+            if self._ring_head[0] == self._ring_tail[0] and not self._ring_ready.wait(timeout):
+                return None
+        return self._ring[self._ring_tail[0] % self.ring_depth]
+    
+    def release_collected(self):
+        '''
+        Marks buffer returned by read_collected() free for collect_data
+
+        Returns
+        -------
+        None.
+
+        '''
+        self._ring_tail[0] += 1
+        self._ring_space.set()
+                
+    def _make_every_n_callback(self, ring, scratch, t0):
+        '''
+        Builds callback for continous_Nread. Everything used in the callback is 
+        bound to closure variables, so that the callback itself does no attribute lookups.
+
+        Parameters
+        ----------
+        ring : SharedBlockRing
+            ring where the blocks are written
+        scratch : array
+            float64 array where DAQmx reads the samples
+        t0 : float
+            start time of the measurement
+
+        Returns
+        -------
+        function
+            callback for register_every_n_samples_acquired_into_buffer_event
+
+        '''
+        _reserve = ring.reserve
+        _publish = ring.publish
+        _read = self._reader.read_many_sample
+        _copyto = np.copyto
+        _pc = perf_counter
+        # DAQmx reads only float64, other blocks are converted from scratch
+        direct = ring.dtype == np.float64
+        # Function that is triggered when desired number of samples is registered
+        def every_n_callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+            block = _reserve()
+            if block is None:
+                # Ring is full, empty driver buffer and drop the block
+                _read(scratch, number_of_samples_per_channel=number_of_samples)
+            elif direct:
+                _read(block, number_of_samples_per_channel=number_of_samples)
+                _publish(_pc()-t0)
+            else:
+                # Read samples and convert them to shared memory
+                _read(scratch, number_of_samples_per_channel=number_of_samples)
+                _copyto(block,scratch,casting='same_kind')
+                _publish(_pc()-t0)
+            return 0  # Must return 0 or DAQmx will consider it an error
+        return every_n_callback
+        
+    def continous_Nread(self,stop_event,ring,sample_rate, Nsamples):
         '''
         Function to read continuously data from DAQ card. Data is read every time 
         callback is triggered. Best function for fast data collection as this is
@@ -124,9 +273,9 @@ class DAQcontrol():
 
         Parameters
         ----------
-        q : multiprocessing queue
-            queue to send the data onwards
-        stop_event : multiprocessing Event
+        ring : SharedBlockRing
+            ring from make_ring to send the data onwards
+        stop_event : multiprocessing or threading Event
             event to stop the data aquisition
         sample_rate : int
             Data measurement rate
@@ -135,63 +284,84 @@ class DAQcontrol():
 
         Returns
         -------
-        Puts data to queue, format is [time, array(shape = Nchannel x Nsamples)]
+        Writes data to ring, ring.get gives [time, block] with 
+        shape = Nchannel x (batch*Nsamples), and consumer must call ring.task_done() after reading it.
+        Individual chunks are found with block.reshape(Nchannel, batch, Nsamples)
+        If consumer has not freed a block, new block is dropped and counted in ring.overruns.
 
         '''
         #!!!
-        # Initalize numpy array
-        out = np.zeros((len(self.channels), Nsamples))
-        # Function that is triggered when desired number of samples is registered
-        def every_n_callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
-            # Create reader
-            reader = AnalogMultiChannelReader(self.task.in_stream)
-            # Read samples to buffer
-            reader.read_many_sample(out, number_of_samples_per_channel=number_of_samples)
-            # Put samples to queue
-            q.put([perf_counter()-t0,out])
-            return 0  # Must return 0 or DAQmx will consider it an error
+        vmin, vmax = self.range
+        # DAQmx reads only float64, samples of dropped and converted blocks are read here first
+        scratch = np.empty(ring.shape)
         # Log starttime
         t0 = perf_counter()
         # Create task
         with nidaqmx.Task() as self.task:
-            # Create voltage channels
-            for ch in self.channels:
-                self.task.ai_channels.add_ai_voltage_chan(ch,min_val=self.range[0], max_val=self.range[1])
+            # Create voltage channels, all with one call using channel expression
+            self.task.ai_channels.add_ai_voltage_chan(self._chan_expr,min_val=vmin, max_val=vmax)
         
             # Setting the rate of the Sample Clock and the number of samples to acquire
-            self.task.timing.cfg_samp_clk_timing(rate = sample_rate, sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan = Nsamples)
+            self.task.timing.cfg_samp_clk_timing(rate = sample_rate, sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan = self.batch*Nsamples)
+            # Always read from current read position and keep room for several 
+            # callbacks in the driver buffer so that acquisition does not overflow.
+            # DAQmx default buffer size is a minimum, so it is only ever grown
+            self.task.in_stream.relative_to = ReadRelativeTo.CURRENT_READ_POSITION
+            self.task.in_stream.offset = 0
+            self.task.in_stream.input_buf_size = max(self.task.in_stream.input_buf_size, 8*self.batch*Nsamples)
+            
+            # Create reader once for all callbacks
+            self._reader = AnalogMultiChannelReader(self.task.in_stream)
+            # Ring buffer shape is fixed, so skip querying channels_to_read from the driver on every read
+            self._reader.verify_array_shape = False
         
-            # Register the callback for every N samples acquired
-            self.task.register_every_n_samples_acquired_into_buffer_event(Nsamples, every_n_callback)
+            # Register the callback for every batch of N samples acquired, 
+            # DAQmx buffer accumulates the chunks so that one queue message carries all of them
+            every_n_callback = self._make_every_n_callback(ring, scratch, t0)
+            self.task.register_every_n_samples_acquired_into_buffer_event(self.batch*Nsamples, every_n_callback)
         
             # Start the task
             self.task.start()
             
-            # Stop the data acquisition when stop event is set
-            while not stop_event.is_set():
-                continue
+            # Block until stop event is set, so that callback thread gets the CPU
+            stop_event.wait()
             self.task.stop()
-            print('Data acquisition stopped')
+            print('Data acquisition stopped, dropped blocks: ' + str(ring.overruns.value))
 
 
-    def continous_Nread_test(self,stop_event,q,sample_rate, Nsamples):
+    def continous_Nread_test(self,stop_event,ring,sample_rate, Nsamples):
         '''
-        Function to test DAQ acquisition without hardware
+        Function to test DAQ acquisition without hardware. Data is generated 
+        at the same pace as DAQ card would produce it with given sample rate.
+        Data is passed in the same way as in continous_Nread, through ring 
+        from make_ring.
 
         '''
-        # Initalize numpy array
-        out = np.ones((len(self.channels), Nsamples))
+        rng = self._rng
+        # Default Windows timer resolution is 15.6 ms, ask for 1 ms
+        if sys.platform == 'win32':
+            ctypes.windll.winmm.timeBeginPeriod(1)
         # Log starttime
         t0 = perf_counter()
+        # Time between data chunks and deadline for next one
+        period = self.batch*Nsamples/sample_rate
+        next_t = t0 + period
         # Create test data until stop event is set
         while not stop_event.is_set():
-            # Create random array
-            rn = 0.2*np.random.rand(len(self.channels), Nsamples)
-
-            q.put([perf_counter()-t0,np.multiply(out,rn)])
-            # Delay to slow down the code
-            time.sleep(1e-3)
-        print('Data acquisition stopped')
+            # Create random array directly to shared memory, block is dropped if ring is full
+            buf = ring.reserve()
+            if buf is not None:
+                rng.random(dtype=ring.dtype,out=buf)
+                buf *= 0.2
+                ring.publish(perf_counter()-t0)
+            # Sleep only the time left until next deadline
+            dt = next_t - perf_counter()
+            if dt > 0:
+                time.sleep(dt)
+            next_t += period
+        if sys.platform == 'win32':
+            ctypes.windll.winmm.timeEndPeriod(1)
+        print('Data acquisition stopped, dropped blocks: ' + str(ring.overruns.value))
 
 
 
@@ -211,13 +381,37 @@ class DAQcontrol():
         None.
 
         '''
-        with nidaqmx.Task() as self.write_task:
+        # Reuse open task for the channel, set up new one only for new channel
+        if channel_out in self._ao_tasks:
+            self.write_task, writer = self._ao_tasks[channel_out]
+        else:
+            self.write_task = nidaqmx.Task()
             # Set up output channel
             self.write_task.ao_channels.add_ao_voltage_chan(channel_out,max_val=10, min_val=-10)
             self.write_task.start()
-            writer = AnalogMultiChannelWriter(self.write_task.in_stream)
-            # Read datapoints from DAQ to out array
-            writer.write_one_sample(np.array([value]))
+            # Output writer must use output stream of the task
+            writer = AnalogSingleChannelWriter(self.write_task.out_stream)
+            self._ao_tasks[channel_out] = (self.write_task, writer)
+        # Write value to output channel
+        writer.write_one_sample(float(value))
+        
+    def close_outputs(self):
+        '''
+        Closes all analog output tasks opened by write_data
+
+        Returns
+        -------
+        None.
+
+        '''
+        for task, writer in self._ao_tasks.values():
+            try:
+                task.stop()
+                task.close()
+            except Exception as e:
+                print(e)
+        self._ao_tasks = {}
+        self.write_task = None
 
                 
     def request_data(self, out, sample_rate, N_samples):
@@ -239,10 +433,10 @@ class DAQcontrol():
         None.
 
         '''
+        vmin, vmax = self.range
         with nidaqmx.Task() as self.task:
-            # Add voltage channels
-            for ch in self.channels:
-                self.task.ai_channels.add_ai_voltage_chan(ch,min_val=self.range[0], max_val=self.range[1])
+            # Add voltage channels, all with one call using channel expression
+            self.task.ai_channels.add_ai_voltage_chan(self._chan_expr,min_val=vmin, max_val=vmax)
             # Setting the rate of the Sample Clock and the number of samples to acquire
             self.task.timing.cfg_samp_clk_timing(sample_rate, source="", sample_mode=AcquisitionType.FINITE, samps_per_chan = N_samples)
             #task.register_done_event(self.callback_method)
@@ -280,6 +474,8 @@ def getChannelNames(device_name):
 
 
 if __name__ == '__main__':
+   # Imported here so that importing this module does not load plotting backend
+   import matplotlib.pyplot as plt
    daq=DAQcontrol(["Dev1/ai1","Dev1/ai2"])
    '''
    filename='D:\\DATA\\AKI\\NIDAQmx\\file4.tdms'
@@ -291,14 +487,25 @@ if __name__ == '__main__':
    logtask=daq.log_data(sample_rate, N_samples, filename)
    
    '''
-   stop_event = mp.Event()
+   # DAQmx runs acquisition in its own thread, so thread is enough and nothing needs to be pickled
+   stop_event = threading.Event()
    sample_rate = 5000
    Nsamples = 100
-   q = mp.Queue()
-   measData = mp.Process(target = daq.continous_Nread,args = (q,stop_event,sample_rate, Nsamples))
+   ring = daq.make_ring(Nsamples)
+   measData = threading.Thread(target = daq.continous_Nread,args = (stop_event,ring,sample_rate, Nsamples), daemon=True)
    measData.start()
-   time.sleep(10)
+   t_end = perf_counter()+10
+   while perf_counter() < t_end:
+       try:
+           t, block = ring.get(timeout=0.1)
+       except Empty:
+           continue
+       print(t, np.average(block, axis=1))
+       ring.task_done()
    stop_event.set()
+   measData.join()
+   del block
+   ring.release()
    
    '''
    N_samples=2
@@ -315,31 +522,46 @@ if __name__ == '__main__':
    N_samples=1000
    daq.maxpoints=100
    starttime=time.perf_counter()
-   q=Queue()
-   
-   starttime=time.perf_counter()
-   daq_th = threading.Thread(target=daq.collect_data, args=( q, sample_rate, N_samples))
+   daq_th = threading.Thread(target=daq.collect_data, args=(sample_rate, N_samples))
    daq_th.Daemon=True
    daq_th.start()
 
    data=[]
    k=0
+   # Preallocated arrays for plotted points, one line per channel is updated instead of new plots
+   K=10000
+   times=np.empty(K)
+   ch0=np.empty(K)
+   ch1=np.empty(K)
+   fig, ax = plt.subplots()
+   line0, = ax.plot([],[],'r.')
+   line1, = ax.plot([],[],'b.')
+   t_draw = time.perf_counter()
    try:
-       while daq_th.isAlive():
-           try:
-               x = q.get_nowait()
-               data.append(x)
-               t = time.perf_counter()
-               if q.qsize()>0:
-                   print('Queue filling: ',q.qsize())
-           except Empty:
-               pass
+       while daq_th.is_alive():
+           # Block until data is available, this leaves the CPU to the DAQ thread
+           x = daq.read_collected(timeout=0.05)
+           if x is None:
+               continue
            else:
-                if k%10==0:
-                    plt.plot(t-starttime,np.average(x[0]),'r.')
-                    plt.plot(t-starttime,np.average(x[1]),'b.')
-                    plt.pause(0.001)
+                x = x.copy()
+                daq.release_collected()
+                data.append(x)
+                t = time.perf_counter()
+                times[k%K] = t-starttime
+                ch0[k%K] = np.mean(x[0])
+                ch1[k%K] = np.mean(x[1])
            k+=1
+           # Redraw at most 20 times per second
+           if t-t_draw > 0.05:
+               n = min(k,K)
+               line0.set_data(times[:n],ch0[:n])
+               line1.set_data(times[:n],ch1[:n])
+               ax.relim()
+               ax.autoscale_view()
+               fig.canvas.draw_idle()
+               plt.pause(0.001)
+               t_draw = t
    finally:
        daq.Stop()
    daq_th.join()
@@ -5,7 +5,6 @@ Created on Wed Sep 23 16:39:17 2020
 @author: akperuht
 """
 import numpy as np
-import matplotlib.pyplot as plt
 import nidaqmx
 from nidaqmx.constants import AcquisitionType ,LoggingMode, LoggingOperation, WaitMode
 from nidaqmx.stream_readers import AnalogMultiChannelReader
@@ -16,6 +15,8 @@ from queue import Queue, Empty
 import time
 import multiprocessing as mp
 from time import perf_counter
+from multiprocessing import shared_memory
+import atexit
 
 class DAQcontrol():
     def __init__(self,channels=None):
@@ -40,6 +41,9 @@ class DAQcontrol():
         self.lock = False
         self.task = None
         self.write_task = None
+        self.read_task = None # Persistent task used by read_data
+        self.reader = None
+        self.reader_config = None
     
     def Stop(self):
         '''
@@ -124,7 +128,7 @@ class DAQcontrol():
 
         Parameters
         ----------
-        q : multiprocessing queue
+        q : multiprocessing queue or SharedBlockRing
             queue to send the data onwards
         stop_event : multiprocessing Event
             event to stop the data aquisition
@@ -135,21 +139,13 @@ class DAQcontrol():
 
         Returns
         -------
-        Puts data to queue, format is [time, array(shape = Nchannel x Nsamples)]
+        Puts data to queue, format is [time, array(shape = Nchannel x Nsamples)].
+        With SharedBlockRing the samples are read directly into the ring blocks
 
         '''
         #!!!
-        # Initalize numpy array
-        out = np.zeros((len(self.channels), Nsamples))
-        # Function that is triggered when desired number of samples is registered
-        def every_n_callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
-            # Create reader
-            reader = AnalogMultiChannelReader(self.task.in_stream)
-            # Read samples to buffer
-            reader.read_many_sample(out, number_of_samples_per_channel=number_of_samples)
-            # Put samples to queue
-            q.put([perf_counter()-t0,out])
-            return 0  # Must return 0 or DAQmx will consider it an error
+        # DAQmx reads only float64, samples of dropped blocks are also read here
+        scratch = np.zeros((len(self.channels), Nsamples))
         # Log starttime
         t0 = perf_counter()
         # Create task
@@ -160,6 +156,33 @@ class DAQcontrol():
         
             # Setting the rate of the Sample Clock and the number of samples to acquire
             self.task.timing.cfg_samp_clk_timing(rate = sample_rate, sample_mode=AcquisitionType.CONTINUOUS, samps_per_chan = Nsamples)
+            
+            # Create reader once for all callbacks
+            read = AnalogMultiChannelReader(self.task.in_stream).read_many_sample
+            if hasattr(q,'reserve'):
+                # Read into shared memory block, float64 blocks without extra copy
+                direct = q.dtype == np.float64
+                def every_n_callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+                    block = q.reserve()
+                    if block is None:
+                        # Ring is full, empty driver buffer and drop the block
+                        read(scratch, number_of_samples_per_channel=number_of_samples)
+                    elif direct:
+                        read(block, number_of_samples_per_channel=number_of_samples)
+                        q.publish(perf_counter()-t0)
+                    else:
+                        read(scratch, number_of_samples_per_channel=number_of_samples)
+                        np.copyto(block,scratch,casting='same_kind')
+                        q.publish(perf_counter()-t0)
+                    return 0  # Must return 0 or DAQmx will consider it an error
+            else:
+                def every_n_callback(task_handle, every_n_samples_event_type, number_of_samples, callback_data):
+                    # Queue pickles data after put returns, so every read gets a new array
+                    out = np.empty((len(self.channels), number_of_samples))
+                    read(out, number_of_samples_per_channel=number_of_samples)
+                    # Put samples to queue
+                    q.put([perf_counter()-t0,out])
+                    return 0  # Must return 0 or DAQmx will consider it an error
         
             # Register the callback for every N samples acquired
             self.task.register_every_n_samples_acquired_into_buffer_event(Nsamples, every_n_callback)
@@ -167,9 +190,8 @@ class DAQcontrol():
             # Start the task
             self.task.start()
             
-            # Stop the data acquisition when stop event is set
-            while not stop_event.is_set():
-                continue
+            # Block until stop event is set, so that callback thread gets the CPU
+            stop_event.wait()
             self.task.stop()
             print('Data acquisition stopped')
 
@@ -261,6 +283,508 @@ class DAQcontrol():
             except Exception as e:
                 print(e)
     
+    def start_reader(self, sample_rate, N_samples):
+        '''
+        Create persistent finite acquisition task and stream reader for read_data,
+        previously created task is closed
+
+        Parameters
+        ----------
+        sample_rate : float
+            Specifies the sampling rate in samples per channel per second
+        N_samples : int
+            Specifies the number of samples to acquire for each channel per read
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.close_reader()
+        self.read_task = nidaqmx.Task()
+        # Add voltage channels
+        for ch in self.channels:
+            self.read_task.ai_channels.add_ai_voltage_chan(ch,min_val=self.range[0], max_val=self.range[1])
+        # Setting the rate of the Sample Clock and the number of samples to acquire
+        self.read_task.timing.cfg_samp_clk_timing(sample_rate, source="", sample_mode=AcquisitionType.FINITE, samps_per_chan = N_samples)
+        # Stream reader is created once and reused for every read
+        self.reader = AnalogMultiChannelReader(self.read_task.in_stream)
+        self.reader_config = (sample_rate, N_samples)
+        
+    def read_data(self, out, sample_rate, N_samples):
+        '''
+        Function for requesting N_samples from DAQ using NI-DAQmx interface.
+        Task and stream reader are kept between calls and rebuilt only when
+        sample rate or number of samples changes
+
+        Parameters
+        ----------
+        out : array 
+            C-contiguous float64 array for data, size (channels) x (samples)         
+        sample_rate : float
+            Specifies the sampling rate in samples per channel per second
+        N_samples : int
+            Specifies the number of samples to acquire for each channel
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.reader is None or self.reader_config != (sample_rate, N_samples):
+            self.start_reader(sample_rate, N_samples)
+        self.read_task.start()
+        try:
+            # Read datapoints from DAQ directly to out array
+            self.reader.read_many_sample(out, number_of_samples_per_channel = N_samples, timeout = 10.0)
+        finally:
+            # Task must be stopped also after failed read, otherwise next start fails
+            self.read_task.stop()
+        
+    def close_reader(self):
+        '''
+        Close persistent task used by read_data
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.read_task is not None:
+            self.read_task.close()
+        self.read_task = None
+        self.reader = None
+        self.reader_config = None
+
+
+class SharedRingQueue():
+    '''
+    Queue-like ring buffer in shared memory for passing numeric data rows
+    from the measurement process to the UI without pickling. Provides the
+    put, empty and get_nowait methods used with multiprocessing.Queue, and
+    get_many to read all new rows as one array. Rows can have variable length up to ncols, the length of each row is
+    stored in the first column. Reader falls behind by more than ring_len
+    rows only if UI stalls, oldest rows are then skipped.
+    '''
+    def __init__(self,ncols,ring_len=4096):
+        '''
+        class constructor
+
+        Parameters
+        ----------
+        ncols : int
+            Maximum number of values in one row
+        ring_len : int, optional
+            Number of rows in the ring buffer. The default is 4096.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.ncols = ncols
+        self.ring_len = ring_len
+        self.shm = shared_memory.SharedMemory(create=True,size=ring_len*(ncols+1)*8)
+        self.write_idx = mp.Value('q',0) # Number of rows written
+        self.exit_flag = mp.Value('b',0) # Set when 'Exit' is put to the queue
+        self.read_idx = 0 # Number of rows read, local to the reading process
+        self.exit_read = False # 'Exit' is returned only once
+        self.owner = True
+        self.ring = np.ndarray((ring_len,ncols+1),dtype=np.float64,buffer=self.shm.buf)
+        # Release shared memory when creating process exits
+        atexit.register(self.release)
+        
+    def __getstate__(self):
+        # Numpy view cannot be pickled, it is reconstructed from shared memory
+        state = self.__dict__.copy()
+        del state['ring']
+        state['owner'] = False
+        return state
+    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.ring = np.ndarray((self.ring_len,self.ncols+1),dtype=np.float64,buffer=self.shm.buf)
+        
+    def put(self,data):
+        '''
+        Write data row to the ring buffer, string 'Exit' is passed as a flag
+
+        Parameters
+        ----------
+        data : list(float), numpy.ndarray or str
+            Data row or 'Exit'
+
+        Returns
+        -------
+        None.
+
+        '''
+        if isinstance(data,str):
+            if data == 'Exit':
+                self.exit_flag.value = 1
+            return
+        n = len(data)
+        if n > self.ncols:
+            raise ValueError('Data row has {} values, maximum is {}'.format(n,self.ncols))
+        idx = self.write_idx.value
+        row = self.ring[idx % self.ring_len]
+        row[0] = n
+        row[1:n+1] = data
+        # Publish row after it has been written
+        self.write_idx.value = idx+1
+        
+    def empty(self):
+        '''
+        Check if there is unread data
+
+        Returns
+        -------
+        bool
+            True if there is nothing to read
+
+        '''
+        if self.read_idx < self.write_idx.value:
+            return False
+        return self.exit_read or not self.exit_flag.value
+    
+    def get_nowait(self):
+        '''
+        Read next data row from the ring buffer
+
+        Raises
+        ------
+        Empty
+            If there is nothing to read
+
+        Returns
+        -------
+        list(float) or str
+            Data row or 'Exit' after all rows have been read
+
+        '''
+        widx = self.write_idx.value
+        if self.read_idx < widx:
+            # Skip rows that have already been overwritten
+            self.read_idx = max(self.read_idx,widx-self.ring_len)
+            row = self.ring[self.read_idx % self.ring_len]
+            self.read_idx += 1
+            return row[1:int(row[0])+1].tolist()
+        if self.exit_flag.value and not self.exit_read:
+            self.exit_read = True
+            return 'Exit'
+        raise Empty
+    
+    def get_many(self,max_rows):
+        '''
+        Read all unread data rows, at most max_rows, with one copy from the
+        ring buffer. 'Exit' is not returned here, it is read with get_nowait
+
+        Parameters
+        ----------
+        max_rows : int
+            Maximum number of rows to read
+
+        Returns
+        -------
+        array
+            Data rows, size (rows) x (longest row length), values missing
+            from shorter rows are NaN
+
+        '''
+        widx = self.write_idx.value
+        # Skip rows that have already been overwritten
+        start = max(self.read_idx,widx-self.ring_len)
+        end = min(widx,start+max_rows)
+        rows = self.ring[np.arange(start,end) % self.ring_len]
+        self.read_idx = max(self.read_idx,end)
+        lengths = rows[:,0].astype(np.intp)
+        width = lengths.max() if len(lengths) else 0
+        data = rows[:,1:width+1]
+        data[np.arange(width) >= lengths[:,None]] = np.nan
+        return data
+    
+    def release(self):
+        '''
+        Close shared memory, creating process also frees it
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.shm is None:
+            return
+        self.ring = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+class PipeQueue():
+    '''
+    One-directional pipe with the put, get, empty and get_nowait methods used with
+    multiprocessing.Queue. Polling the pipe does not take the queue lock and
+    messages are sent without the queue feeder thread. Intended for a single
+    writer and a single reader, e.g. UI sending parameters to measurement.
+    '''
+    def __init__(self):
+        self.conn_recv, self.conn_send = mp.Pipe(duplex=False)
+        
+    def put(self,data):
+        '''
+        Send message to the reading end
+
+        Parameters
+        ----------
+        data : object
+            Picklable message
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.conn_send.send(data)
+        
+    def empty(self):
+        '''
+        Check if there are unread messages
+
+        Returns
+        -------
+        bool
+            True if there is nothing to read
+
+        '''
+        return not self.conn_recv.poll(0)
+    
+    def get_nowait(self):
+        '''
+        Read next message
+
+        Raises
+        ------
+        Empty
+            If there is nothing to read
+
+        Returns
+        -------
+        object
+            Received message
+
+        '''
+        if not self.conn_recv.poll(0):
+            raise Empty
+        return self.conn_recv.recv()
+    
+    def get(self,timeout=None):
+        '''
+        Wait for next message
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum waiting time in seconds, None waits until a message
+            arrives. The default is None.
+
+        Raises
+        ------
+        Empty
+            If nothing arrived before timeout
+
+        Returns
+        -------
+        object
+            Received message
+
+        '''
+        if not self.conn_recv.poll(timeout):
+            raise Empty
+        return self.conn_recv.recv()
+    
+class SharedBlockRing():
+    '''
+    Single producer, single consumer ring of fixed shape data blocks
+    in shared memory, e.g. raw DAQ reads of size (channels) x (samples).
+    Items are [timestamp, block] as with multiprocessing.Queue, but blocks
+    are written once into shared memory and the consumer reads them in place
+    without pickling. Producer either copies a block with put or writes it in
+    place to the view returned by reserve and calls publish. Consumer calls 
+    task_done after it has processed the block returned by get, so that the 
+    slot can be reused. If consumer falls behind by all slots, new blocks are 
+    dropped and counted in overruns instead of blocking the producer.
+    '''
+    def __init__(self,shape,nslots=16,dtype=np.float64):
+        '''
+        class constructor
+
+        Parameters
+        ----------
+        shape : tuple(int)
+            Shape of one data block
+        nslots : int, optional
+            Number of blocks in the ring. The default is 16.
+        dtype : numpy dtype, optional
+            Data type of the blocks, timestamps are always float64. The default is np.float64.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.shape = tuple(shape)
+        self.nslots = nslots
+        self.dtype = np.dtype(dtype)
+        # Timestamps of all slots are followed by the blocks
+        self.block_size = int(np.prod(self.shape))*self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True,size=nslots*(8+self.block_size))
+        self.head = mp.Value('q',0,lock=False) # Number of blocks written
+        self.tail = mp.Value('q',0,lock=False) # Number of blocks processed
+        self.overruns = mp.Value('q',0,lock=False) # Number of dropped blocks
+        self.data_event = mp.Event() # Set when new block is written
+        self.owner = True
+        self._make_views()
+        
+    def _make_views(self):
+        # Numpy views to timestamps and blocks in shared memory
+        self.times = np.ndarray(self.nslots,dtype=np.float64,buffer=self.shm.buf)
+        self.blocks = [np.ndarray(self.shape,dtype=self.dtype,buffer=self.shm.buf,
+                                  offset=self.nslots*8+k*self.block_size)
+                       for k in range(self.nslots)]
+        
+    def __getstate__(self):
+        # Numpy views cannot be pickled, they are reconstructed from shared memory
+        state = self.__dict__.copy()
+        del state['times']
+        del state['blocks']
+        state['owner'] = False
+        return state
+    
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self._make_views()
+        
+    def reserve(self):
+        '''
+        Get next free block for writing in place, publish it when written
+
+        Returns
+        -------
+        array or None
+            View to the block in shared memory, None if the ring is full and 
+            the block is dropped
+
+        '''
+        head = self.head.value
+        if head-self.tail.value >= self.nslots:
+            self.overruns.value += 1
+            return None
+        return self.blocks[head % self.nslots]
+    
+    def publish(self,timestamp):
+        '''
+        Publish block returned by reserve to the consumer
+
+        Parameters
+        ----------
+        timestamp : float
+            Timestamp of the block
+
+        Returns
+        -------
+        None.
+
+        '''
+        head = self.head.value
+        self.times[head % self.nslots] = timestamp
+        # Publish block after it has been written
+        self.head.value = head+1
+        self.data_event.set()
+        
+    def put(self,item):
+        '''
+        Copy data block to the ring
+
+        Parameters
+        ----------
+        item : list
+            [timestamp, block], block is array with shape of the ring
+
+        Returns
+        -------
+        bool
+            False if the block was dropped because the ring is full
+
+        '''
+        timestamp, block = item
+        out = self.reserve()
+        if out is None:
+            return False
+        out[...] = block
+        self.publish(timestamp)
+        return True
+        
+    def get(self,timeout=None):
+        '''
+        Get oldest unprocessed block, call task_done when it has been processed
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum waiting time in seconds. The default is None, wait forever.
+
+        Raises
+        ------
+        Empty
+            If no block was written within timeout
+
+        Returns
+        -------
+        list
+            [timestamp, block], block is a view to shared memory
+
+        '''
+        tail = self.tail.value
+        if tail >= self.head.value:
+            self.data_event.clear()
+            # Check again so that a block written before clear is not missed
+            if tail >= self.head.value:
+                self.data_event.wait(timeout)
+                if tail >= self.head.value:
+                    raise Empty
+        slot = tail % self.nslots
+        return [self.times[slot],self.blocks[slot]]
+    
+    def task_done(self):
+        '''
+        Mark block returned by get processed, its slot can be reused
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.tail.value += 1
+        
+    def release(self):
+        '''
+        Close shared memory, creating process also frees it. All views to
+        the blocks must be deleted before calling this.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.shm is None:
+            return
+        self.times = None
+        self.blocks = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+    
 def getChannelNames(device_name):
     '''
     Method to get available physical ai channels of the device
@@ -280,6 +804,7 @@ def getChannelNames(device_name):
 
 
 if __name__ == '__main__':
+   import matplotlib.pyplot as plt
    daq=DAQcontrol(["Dev1/ai1","Dev1/ai2"])
    '''
    filename='D:\\DATA\\AKI\\NIDAQmx\\file4.tdms'
@@ -857,6 +857,19 @@ class SR810_30_lockin():
             self.set_freq_ampl(self.frequency,self.sine_ampl)
         
         
+    @property
+    def sens(self):
+        '''
+        Sensitivity setting string
+        '''
+        return self._sens
+    
+    @sens.setter
+    def sens(self,sens):
+        self._sens = sens
+        # Cache voltage sensitivity, it is needed for every measured point
+        self.sens_volt = self.get_sens_voltage(sens)
+        
     @staticmethod
     def get_sens_voltage(sens):
         '''
@@ -953,6 +966,19 @@ class SR810_30_lockin():
         '''
         self.sens=self.sens_options[int(self.instr_gpib.query('SENS?'))]
         return self.get_sens_voltage(self.sens)*1e3
+    
+    def is_locked(self):
+        '''
+        Queries reference unlock bit of the LIA status byte.
+        Reading clears the bit, so it reports unlocks since previous query
+
+        Returns
+        -------
+        bool
+            True if reference has stayed locked since previous query
+
+        '''
+        return int(self.instr_gpib.query('LIAS? 3')) == 0
             
     
     def read_settings(self):
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the measurement scripts: optional numba, HDF5 data
+logging and pinning processes to CPU cores
+
+@author: akperuht
+"""
+import os
+import numpy as np
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    # Numba is optional, without it the kernels run as plain Python and numpy
+    NUMBA_AVAILABLE = False
+    prange = range
+    def njit(*args,**kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+def pinProcess(cpu,pid=0,name='acquisition'):
+    '''
+    Pin process to CPU core to avoid jitter from migrating between cores and
+    to keep it and its data on the same core. Uses os.sched_setaffinity on
+    Linux and psutil elsewhere if it is installed.
+
+    Parameters
+    ----------
+    cpu : int or None
+        CPU core, None lets OS decide
+    pid : int, optional
+        Process id, 0 is the calling process. The default is 0.
+    name : str, optional
+        Name of the process used in error message. The default is 'acquisition'.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if cpu is None:
+        return
+    try:
+        if hasattr(os,'sched_setaffinity'):
+            os.sched_setaffinity(pid,{cpu})
+        else:
+            import psutil
+            psutil.Process(pid or None).cpu_affinity([cpu])
+    except Exception as e:
+        print('Could not pin '+name+' process to CPU '+str(cpu)+': '+str(e))
+
+
+class H5Logger():
+    '''
+    Log data to HDF5 file. Numeric rows are buffered and appended to a
+    chunked, lzf compressed dataset 'data', string header is stored to
+    attribute 'header' and list of data labels to attribute 'labels'
+    '''
+    def __init__(self,filename,buffer_rows=256):
+        '''
+        class constructor, file is opened for appending
+
+        Parameters
+        ----------
+        filename : str
+            HDF5 file name
+        buffer_rows : int, optional
+            Number of rows buffered before they are appended to the dataset. The default is 256.
+
+        Returns
+        -------
+        None.
+
+        '''
+        # h5py is only needed in the acquisition process when HDF5 logging is used
+        import h5py
+        self.filename = filename
+        self.buffer_rows = buffer_rows
+        self._h5 = h5py.File(filename,'a')
+        self._ds = None
+        self._buf = None
+        self._n = 0
+
+    def write(self,data):
+        '''
+        Write data to the file
+
+        Parameters
+        ----------
+        data : numpy.ndarray, str or list(str)
+            Data row, header or data labels
+
+        Returns
+        -------
+        None.
+
+        '''
+        if isinstance(data,str):
+            self._h5.attrs['header'] = data
+        elif not isinstance(data,np.ndarray):
+            self._h5.attrs['labels'] = [str(di).strip() for di in data]
+        else:
+            # Dataset is created with the width of the first row
+            if self._ds is None:
+                ncols = data.size
+                if 'data' in self._h5:
+                    self._ds = self._h5['data']
+                else:
+                    self._ds = self._h5.create_dataset('data',shape=(0,ncols),maxshape=(None,ncols),
+                                                       chunks=(1024,ncols),dtype='f8',compression='lzf')
+                self._buf = np.empty((self.buffer_rows,ncols))
+                self._n = 0
+            self._buf[self._n] = data
+            self._n += 1
+            if self._n == self._buf.shape[0]:
+                self.flush()
+
+    def flush(self):
+        '''
+        Append buffered rows to the dataset
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._ds is None or self._n == 0:
+            return
+        n0 = self._ds.shape[0]
+        self._ds.resize(n0+self._n,axis=0)
+        self._ds[n0:] = self._buf[:self._n]
+        self._n = 0
+        self._h5.flush()
+
+    def close(self):
+        '''
+        Flush and close the file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._h5 is None:
+            return
+        self.flush()
+        self._h5.close()
+        self._h5 = None
+        self._ds = None
+        self._buf = None
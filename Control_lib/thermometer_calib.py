@@ -4,10 +4,515 @@ Calibration equations for different cryostat thermometers
 
 @author: akperuht
 """
+import math
 import numpy as np
-import matplotlib.pyplot as plt
 import warnings
 from time import perf_counter
+# Numba is optional, without it the scalar kernels run as plain Python
+# and arrays are evaluated with numpy
+try:
+    from .meas_utils import njit, prange, NUMBA_AVAILABLE
+except ImportError:
+    # Imported as top level module when Control_lib is on sys.path
+    from meas_utils import njit, prange, NUMBA_AVAILABLE
+
+# Bound name avoids attribute lookup in the calibration functions
+_warn = warnings.warn
+
+# 10**x is evaluated as exp2(x*LOG2_10), which has a faster vectorized loop
+LOG2_10 = np.log2(10.0)
+
+# Koirankoppi dipstick Chebyshev coefficients and log10(R) domains
+# Calibration between 4.2 K and 18.087 K, 9816 ohms to 1030.73 ohms
+_DIPSTICK_COEF_L = np.array([1.0305706890196387,
+                             -0.44538638729688446,
+                             0.038245646079858205,
+                             0.00040965728900122016,
+                             -0.0012118796335522266,
+                             0.00016675566193886398,
+                             -0.0003134743277859895,
+                             -4.9862349494365405e-05,
+                             -0.0002538643045723284,
+                             2.930529810139165e-05,
+                             0.00010177604830833634,
+                             ])
+_DIPSTICK_DOMAIN_L = (2.72290035,3.99196185)
+# Calibration between 18.087 K - 107.681 K, 1030.73 ohms to 143.125 ohms
+_DIPSTICK_COEF_M = np.array([1.7681898764629274,
+                             -0.5246006794490299,
+                             -0.0009736793484812508,
+                             0.003478858170366785,
+                             0.0008144241470007147,
+                             0.00010086660798327552,
+                             -0.0002057511678956854,
+                             -1.0562017354248726e-05,
+                             0.00021521449198016844,
+                             -0.0003566476960957493,
+                             -0.00031293753057890167,
+                             ])
+_DIPSTICK_DOMAIN_M = (1.86381739,3.02540734)
+# Calibration between 107.681 K - 295.3 K, 143.125 ohms to 45.775 ohms
+_DIPSTICK_COEF_H = np.array([2.2479945607783676,
+                             -0.220244799396414,
+                             0.0001736586172434195,
+                             -0.0014264062220913924,
+                             0.00016439143464969143,
+                             -0.00015075504768659046,
+                             -7.754154576623546e-05,
+                             -0.00011707662585304951,
+                             -2.3972858842214167e-05,
+                             -0.00010280191330409421,
+                             -5.983916339295706e-06,
+                             ])
+_DIPSTICK_DOMAIN_H = (1.66062417,2.16173695)
+# Segment boundaries in ohms and segments in increasing resistance order,
+# segments are selected with the same comparisons as the original R-space code
+_DIPSTICK_BOUNDS = np.array([143.125,1030.73])
+_DIPSTICK_COEFS = np.vstack((_DIPSTICK_COEF_H,_DIPSTICK_COEF_M,_DIPSTICK_COEF_L))
+_DIPSTICK_DOMAINS = np.array((_DIPSTICK_DOMAIN_H,_DIPSTICK_DOMAIN_M,_DIPSTICK_DOMAIN_L))
+
+# Morso CX-1050-SD-HT Chebyshev coefficients and log10(R) domains
+# Calibration between 4.2 K and 20 K
+# domain between 3070.9799999999996 ohms to 626.8690000000003 ohms
+_MORSO_COEF_L = np.array([0.9506674308499167,
+                          -0.35199927764236455,
+                          0.016258403822749814,
+                          0.0055715910387260014,
+                          0.0008861267363886899,
+                          -0.0005390646317558515,
+                          0.00046234441088706396,
+                          -0.00034663919545294743,
+                          1.8900818521904524e-05,
+                          -0.0006577629496062799,
+                          -0.0010153963072063212
+                          ])
+_MORSO_DOMAIN_L = (2.79717679, 3.48727699)
+# Calibration between 20 K - 70 K
+# domain between 629.86 to  221.75ohms
+_MORSO_COEF_M = np.array([1.57422337136405,
+                          -0.2644571720191467,
+                          0.0018751976846375657,
+                          0.00015485832655411989,
+                          0.0002687387319480107,
+                          0.00042994288778457724,
+                          0.0001854343092784725,
+                          0.000677677389021527,
+                          2.7489387520667344e-05,
+                          -6.839382864240871e-05,
+                          0.00013297037462381675
+                          ])
+_MORSO_DOMAIN_M = (2.34587734, 2.79924403)
+# Calibration between 70 K - 260 K
+# domain between 252.52599 ohms to 64.0478 ohms
+_MORSO_COEF_H = np.array([2.105907955347509,
+                          -0.32561185605929055,
+                          -0.00452466867832195,
+                          -0.0041969745056598,
+                          0.002813068419108741,
+                          -0.0012856814956658373,
+                          0.001022107637142309,
+                          -0.0008692536680943596,
+                          0.0005275420860334051,
+                          -0.0007986614863778288,
+                          0.0004594498328113981,
+                          ])
+_MORSO_DOMAIN_H = (1.80650422, 2.4023061)
+# Calibration between 260 K - 293 K
+# Domain between 58.184299999999986 ohm to 73.04270000000002 ohm
+_MORSO_COEF_UH = np.array([2.419846561814242,
+                           -0.05110237731635884,
+                           -0.00032812984876488935,
+                           0.00019824559266527853,
+                           -0.0009580047292876272,
+                           0.0004420826699351031,
+                           -0.00031778576498260353,
+                           9.294972361020348e-05,
+                           0.0002128491379170427,
+                           -7.140389360008976e-05,
+                           -9.114398708705641e-05
+                           ])
+_MORSO_DOMAIN_UH = (1.7648058138045555,1.8635768183793173)
+# Segment boundaries in ohms and segments in increasing resistance order,
+# high range is also used above calibrated temperature range
+_MORSO_BOUNDS = np.array([58,64.04780000000001,224.38862779880543,620.847233906399])
+_MORSO_COEFS = np.vstack((_MORSO_COEF_H,_MORSO_COEF_UH,_MORSO_COEF_H,
+                          _MORSO_COEF_M,_MORSO_COEF_L))
+_MORSO_DOMAINS = np.array((_MORSO_DOMAIN_H,_MORSO_DOMAIN_UH,_MORSO_DOMAIN_H,
+                           _MORSO_DOMAIN_M,_MORSO_DOMAIN_L))
+
+# Cernox CX-1050-AA-1.4L Chebyshev coefficients and log10(R) limits
+# Low temperature, useful range of fit: 1.40 K to 14.3 K
+# 9825 ohms to 689.3 ohms
+_CX1050_COEF_LOW = np.array([5.527867,
+                             -6.379248,
+                             2.855709,
+                             -1.065175,
+                             0.334348,
+                             -0.084377,
+                             0.013947,
+                             0.000599,
+                             -0.001649,
+                             0.001212,
+                             ])
+_CX1050_ZL_LOW = 2.79894969622
+_CX1050_ZU_LOW = 4.13119755741
+# Middle temperature, useful range of fit: 14.3 K to 80.3 K
+# 689.3 ohms to 189.3 ohms
+_CX1050_COEF_MIDDLE = np.array([43.034893,
+                                -38.016846,
+                                8.162617,
+                                -0.935864,
+                                0.093585,
+                                -0.003306,
+                                -0.006104,
+                                ])
+_CX1050_ZL_MIDDLE = 2.23461882459
+_CX1050_ZU_MIDDLE = 2.88553993198
+# High temperature, useful range of fit: 80.3 K to 325 K
+# 189.3 ohms to 54.31 ohms
+_CX1050_COEF_HIGH = np.array([177.551522,
+                              -126.721728,
+                              22.066582,
+                              -3.115138,
+                              0.595049,
+                              -0.112115,
+                              0.015706,
+                              ])
+_CX1050_ZL_HIGH = 1.72880129581
+_CX1050_ZU_HIGH = 2.3242938345
+
+# Old dipstick power series coefficients, constant term first
+# Low temperature <5 K polynomial fit
+_DIPSTICK_OLD_COEF_LOW = np.array([128.879,
+                                   -0.0705395,
+                                   1.62013e-5,
+                                   -1.86716e-9,
+                                   1.07371e-13,
+                                   -2.45959e-18,
+                                   ])
+# Around 15-35 K polynomial fit
+_DIPSTICK_OLD_COEF_MID = np.array([112.562,
+                                   -0.301794,
+                                   0.000446408,
+                                   -3.87763e-7,
+                                   1.99219e-10,
+                                   -5.62812e-14,
+                                   6.76502e-18,
+                                   ])
+# Base fit to all temperatures, series in 1/R
+_DIPSTICK_OLD_COEF_BASE = np.array([2.53409,
+                                    17255.7,
+                                    -397237,
+                                    2.66201e7,
+                                    -1.8702e9,
+                                    7.88601e10,
+                                    -1.26323e12,
+                                    ])
+
+# Old Ling power series coefficients, constant term first
+_LING_OLD_COEF = np.array([0.8287,
+                           -1.76454e-4,
+                           2.11729e-8,
+                           -1.57071e-12,
+                           7.61027e-17,
+                           -2.4539e-21,
+                           5.22219e-26,
+                           -7.04414e-31,
+                           5.45476e-36,
+                           -1.84632e-41,
+                           ])
+
+# Ling Chebyshev coefficients, calibration between 40 mK and 20K
+_LING_COEF = np.array([-5.30606160e-01,
+                       -1.20610503e+00,
+                       3.99019199e-01,
+                       -1.75532773e-01,
+                       1.14216706e-01,
+                       -7.73419751e-02,
+                       5.40618959e-02,
+                       -3.86658100e-02,
+                       2.85303341e-02,
+                       -2.16080176e-02,
+                       1.63169093e-02,
+                       -1.29182752e-02,
+                       1.06184792e-02,
+                       -7.98300833e-03,
+                       6.02191244e-03,
+                       -4.32414907e-03,
+                       3.41879026e-03,
+                       -2.75739361e-03,
+                       2.04716983e-03,
+                       -1.22720374e-03,
+                       5.69061400e-04
+                       ])
+_LING_DOMAIN = (3.0204657, 5.17597456)
+_LING_POLY = np.polynomial.Chebyshev(_LING_COEF,domain = _LING_DOMAIN,window = [-1,1])
+
+# Kanada Chebyshev coefficients for different temperature ranges
+_KANADA_COEF_M = np.array([107.6682289065,
+                           -169.5447785940,
+                           86.4765089174,
+                           -28.0981575764,
+                           6.1235649200,
+                           -1.9503945254,
+                           1.0131764357,
+                           -0.2848764539,
+                           0.0754777049,
+                           -0.1217169204,
+                           0.0183919674
+                           ])
+_KANADA_ZU_M = 3.0937542834
+_KANADA_ZL_M = 1.5133641164
+_KANADA_COEF_L = np.array([6.8642361690,
+                           -7.6201321296,
+                           2.9185476218,
+                           -0.8169479610,
+                           0.1364804787,
+                           0.0336174734,
+                           -0.0445366064,
+                           0.0282235691,
+                           -0.0018566792,
+                           -0.0065261097,
+                           0.0115414837
+                           ])
+_KANADA_ZL_L = 2.3746383841
+_KANADA_ZU_L = 3.0937542834
+# Same ranges as log10(R) domains for the compiled kernels
+_KANADA_DOMAIN_M = (_KANADA_ZL_M,_KANADA_ZU_M)
+_KANADA_DOMAIN_L = (_KANADA_ZL_L,_KANADA_ZU_L)
+
+# Kanada low temperature 2022 calibration, Chebyshev in linear resistance
+_KANADA_LT_COEF = np.array([4.837741078001092,
+                            -5.0386618786563675,
+                            2.6011253829600314,
+                            -1.2811240931100099,
+                            0.6202351699537209,
+                            -0.290718100542933,
+                            0.13446140588234368,
+                            -0.06110535096065962,
+                            0.027152555428268582,
+                            -0.010518962898060267,
+                            0.006875088171212802,
+                            -0.0025596374495960084
+                            ])
+_KANADA_LT_DOMAIN = (268.137, 1202.448)
+_KANADA_LT_POLY = np.polynomial.Chebyshev(_KANADA_LT_COEF,domain = _KANADA_LT_DOMAIN,window = [-1,1])
+
+
+def pow10(x):
+    '''
+    Calculate 10**x with exp2, which uses a faster vectorized loop than
+    the generic power function
+
+    Parameters
+    ----------
+    x : float or array(float)
+        Exponent
+
+    Returns
+    -------
+    float or array(float)
+        10 to the power of x
+
+    '''
+    return np.exp2(x*LOG2_10)
+
+
+@njit(cache=True,fastmath=True)
+def _clenshaw(k,coef):
+    '''
+    Evaluate Chebyshev series at scalar k with Clenshaw recurrence.
+    Even terms are summed as T_j(y) and odd terms as k*V_j(y), where
+    y = T_2(k) and V_j are Chebyshev polynomials of the third kind. Both
+    recurrences are independent, so the dependency chain is halved.
+    '''
+    n = len(coef)
+    y = 2*k*k-1
+    y2 = 2*y
+    be1 = 0.0
+    be2 = 0.0
+    bo1 = 0.0
+    bo2 = 0.0
+    for j in range((n+1)//2-1,0,-1):
+        be1, be2 = coef[2*j] + y2*be1 - be2, be1
+        if 2*j+1 < n:
+            bo1, bo2 = coef[2*j+1] + y2*bo1 - bo2, bo1
+    even = coef[0] + y*be1 - be2
+    if n < 2:
+        return even
+    return even + k*(coef[1] + (y2-1)*bo1 - bo2)
+
+
+@njit(cache=True,fastmath=True)
+def _cheb_log10(lr,coef,domain):
+    '''
+    Evaluate Chebyshev series with lr = log10(R) mapped from domain to [-1,1]
+    '''
+    k = (2*lr-(domain[0]+domain[1]))/(domain[1]-domain[0])
+    return _clenshaw(k,coef)
+
+
+def _chebval_segments(R,bounds,coefs,domains):
+    '''
+    Evaluate piecewise log-log Chebyshev calibration on arrays with numpy
+
+    Parameters
+    ----------
+    R : array(float)
+        Resistance in ohms
+    bounds : array(float)
+        Increasing segment boundaries in ohms
+    coefs : array(float)
+        Chebyshev coefficients, one row per segment
+    domains : array(float)
+        log10 resistance domain of each segment, one row per segment
+
+    Returns
+    -------
+    T : array(float)
+        Temperature in kelvins
+
+    '''
+    # Label calibration range of each value in one pass, compared in ohms so
+    # that values at the boundaries fall in the same segment as in R-space code
+    seg = np.searchsorted(bounds,R,side='right')
+    logR = np.log10(R)
+    T = np.empty_like(logR)
+    for i in range(len(coefs)):
+        mask = seg == i
+        # Map log10 resistance to Chebyshev window [-1,1]
+        k = (2*logR[mask]-(domains[i,0]+domains[i,1]))/(domains[i,1]-domains[i,0])
+        T[mask] = pow10(np.polynomial.chebyshev.chebval(k,coefs[i]))
+    return T
+
+
+@njit(cache=True,fastmath=True,parallel=True)
+def _chebval_segments_fused(R,bounds,coefs,domains):
+    '''
+    Compiled variant of _chebval_segments. Segment selection, log10,
+    Chebyshev series and power of ten are done in one pass per value,
+    without intermediate arrays.
+    '''
+    T = np.empty_like(R)
+    for i in prange(R.shape[0]):
+        r = R[i]
+        s = 0
+        while s < bounds.shape[0] and r >= bounds[s]:
+            s += 1
+        T[i] = 10**_cheb_log10(math.log10(r),coefs[s],domains[s])
+    return T
+
+
+def _piecewise_calibration(R,bounds,coefs,domains):
+    '''
+    Evaluate piecewise log-log Chebyshev calibration, with the fused
+    kernel when numba is available. Parameters as in _chebval_segments.
+    '''
+    if NUMBA_AVAILABLE:
+        R = np.asarray(R,dtype=np.float64)
+        return _chebval_segments_fused(R.ravel(),bounds,coefs,domains).reshape(R.shape)
+    return _chebval_segments(R,bounds,coefs,domains)
+
+
+@njit(cache=True,fastmath=True)
+def _dipstick_scalar(R):
+    '''
+    Scalar kernel of calibration_dipstick_new, R in ohms
+    '''
+    if R <= 0:
+        return 0.0
+    # Branch on resistance and evaluate in log-space, logarithm is taken only once
+    lr = math.log10(R)
+    if R>=_DIPSTICK_BOUNDS[1]:
+        T = 10**_cheb_log10(lr,_DIPSTICK_COEF_L,_DIPSTICK_DOMAIN_L)
+    elif R>=_DIPSTICK_BOUNDS[0]:
+        T = 10**_cheb_log10(lr,_DIPSTICK_COEF_M,_DIPSTICK_DOMAIN_M)
+    else:
+        T = 10**_cheb_log10(lr,_DIPSTICK_COEF_H,_DIPSTICK_DOMAIN_H)
+    # Check that temperature is reasonable, and if not return zero
+    if 0<T<400:
+        return T
+    return 0.0
+
+
+@njit(cache=True,fastmath=True,error_model='numpy')
+def _horner(x,coef):
+    '''
+    Evaluate power series at scalar x with Horner's rule, coef[i] multiplies x**i
+    '''
+    s = 0.0
+    for j in range(len(coef)-1,-1,-1):
+        s = s*x + coef[j]
+    return s
+
+
+@njit(cache=True,fastmath=True,error_model='numpy')
+def _dipstick_old_scalar(R):
+    '''
+    Scalar kernel of calibration_dipstick_old, R in ohms
+    '''
+    # Low temperature <5 K polynomial fit
+    if R>6976.7051348175764:
+        return _horner(R,_DIPSTICK_OLD_COEF_LOW)
+    # Around 15-35 K polynomial fit
+    elif 500<R and R<1603.7310207365606:
+        return _horner(R,_DIPSTICK_OLD_COEF_MID)
+    # Linear approximation to maintain continuity
+    elif 480<R and R<500:
+        return -0.068789*R+69.9864
+    # Base fit to all temperatures
+    return _horner(1.0/R,_DIPSTICK_OLD_COEF_BASE)
+
+
+@njit(cache=True,fastmath=True)
+def _kanada_scalar(R):
+    '''
+    Scalar kernel of calibration_Kanada_func, R in ohms and positive
+    '''
+    lr = math.log10(R)
+    if R >= 287.6046:
+        return _cheb_log10(lr,_KANADA_COEF_L,_KANADA_DOMAIN_L)
+    return _cheb_log10(lr,_KANADA_COEF_M,_KANADA_DOMAIN_M)
+
+
+@njit(cache=True,fastmath=True)
+def _kanada_lt_scalar(R):
+    '''
+    Scalar kernel of calibration_Kanada_lowtemp_2022, R in ohms
+    '''
+    d0, d1 = _KANADA_LT_DOMAIN
+    return _clenshaw((2*R-(d0+d1))/(d1-d0),_KANADA_LT_COEF)
+
+
+@njit(cache=True,fastmath=True)
+def _morso_scalar(R):
+    '''
+    Scalar kernel of calibration_morso, R in ohms.
+    Returns temperature and range flag: -1 below calibrated temperature
+    range, 1 above it and 0 inside.
+    '''
+    if R <= 0:
+        return 0.0, 1
+    flag = 0
+    # Branch on resistance and evaluate in log-space, logarithm is taken only once
+    lr = math.log10(R)
+    if R>=_MORSO_BOUNDS[3]:#low, crossing point between low and mid, though domain is in 626 for low
+        T = 10**_cheb_log10(lr,_MORSO_COEF_L,_MORSO_DOMAIN_L)
+        if R>=3071:
+            flag = -1
+    elif R>=_MORSO_BOUNDS[2]:#mid, mid high has a close crossing near mid domain 221
+        T = 10**_cheb_log10(lr,_MORSO_COEF_M,_MORSO_DOMAIN_M)
+    elif R>=_MORSO_BOUNDS[1]:#high
+        T = 10**_cheb_log10(lr,_MORSO_COEF_H,_MORSO_DOMAIN_H)
+    elif R>=_MORSO_BOUNDS[0]:
+        T = 10**_cheb_log10(lr,_MORSO_COEF_UH,_MORSO_DOMAIN_UH)
+    else:
+        T = 10**_cheb_log10(lr,_MORSO_COEF_H,_MORSO_DOMAIN_H)#above high
+        flag = 1
+    # Check that temperature is reasonable, and if not return zero
+    if 0<T<400:
+        return T, flag
+    return 0.0, flag
 
 def calibration_dipstick_old(R,multiplier):
     '''
@@ -28,22 +533,8 @@ def calibration_dipstick_old(R,multiplier):
         Temperature in Kelvins
 
     '''
-    R=R*multiplier
-    points=[480,500,1603.7310207365606,6976.7051348175764]
-    # Low temperature <5 K polynomial fit
-    T=0
-    if R>points[3]:
-        T=-2.45959e-18*R**5+1.07371e-13*R**4-1.86716e-9*R**3+1.62013e-5*R**2-0.0705395*R+128.879
-    # Around 15-35 K polynomial fit
-    elif points[1]<R and R<points[2]:
-        T=6.76502e-18 *R**6-5.62812e-14*R**5+1.99219e-10*R**4-3.87763e-7*R**3+0.000446408*R**2-0.301794*R+112.562
-    # Linear approximation to maintain continuity
-    elif points[0]<R and R<points[1]:
-        T=-0.068789*R+69.9864
-    # Base fit to all temperatures
-    else:
-        T=-1.26323e12*R**(-6)+7.88601e10*R**(-5)-1.8702e9*R**(-4)+2.66201e7*R**(-3)-397237*R**(-2)+17255.7*R**(-1)+2.53409
-    return T
+    # Correct resistance with multiplier and evaluate compiled kernel
+    return _dipstick_old_scalar(float(R*multiplier))
 
 def calibration_Ling_old(R,multiplier):
     '''
@@ -66,9 +557,8 @@ def calibration_Ling_old(R,multiplier):
 
     '''
     R = R*multiplier
-    return 0.8287 - 1.76454e-4*R + 2.11729e-8*R**2 - 1.57071e-12*R**3 +\
-            7.61027e-17*R**4 - 2.4539e-21*R**5 + 5.22219e-26*R**6 -\
-            7.04414e-31*R**7 +5.45476e-36*R**8 - 1.84632e-41*R**9
+    # Horner's rule instead of explicit powers of R
+    return np.polynomial.polynomial.polyval(R,_LING_OLD_COEF)
             
          
 def calibration_CX1050_AA_14L(R,**kwargs):
@@ -78,84 +568,76 @@ def calibration_CX1050_AA_14L(R,**kwargs):
 
     Parameters
     ----------
-    R : float
+    R : float or array(float)
         Thermometer resistance
     **kwargs : 
         'multip', resistance multiplier
 
     Returns
     -------
-    T : TYPE
-        DESCRIPTION.
+    T : float or array(float)
+        Temperature in Kelvins
 
     '''
     # Correct resistance with multiplier if necessary
     multip = 1
     if 'multip' in kwargs:
         multip = kwargs['multip']
-    R = R*multip
-    
-    # Low temperature coefficients, useful range of fit: 
-    # 1.40 K to 14.3 K
-    # 9825 ohms to 689.3 ohms
-    coef_low = [5.527867,  
-                -6.379248,
-                2.855709, 
-                -1.065175,
-                0.334348,
-                -0.084377,
-                0.013947,
-                0.000599,
-                -0.001649,
-                0.001212,
-                ]
-    ZL_low = 2.79894969622
-    ZU_low = 4.13119755741
-    
-    
     
-    # Middle temperature coefficients, useful range of fit:
-    # 14.3 K to 80.3 K
-    # 689.3 ohms to 189.3 ohms 
-    coef_middle = [43.034893,
-                    -38.016846,
-                    8.162617, 
-                    -0.935864,
-                    0.093585,
-                    -0.003306,
-                    -0.006104,
-                    ]
-    ZL_middle = 2.23461882459 
-    ZU_middle = 2.88553993198
-    
-    
-    # High temperature coefficients, useful range of fit:
-    # 80.3 K to 325 K
-    # 189.3 ohms to 54.31 ohms
-    coef_high = [177.551522, 
-                -126.721728,
-                22.066582,  
-                -3.115138,  
-                0.595049,   
-                -0.112115,  
-                0.015706,   
-                ]
-    ZL_high = 1.72880129581
-    ZU_high = 2.3242938345
+    if not np.isscalar(R):
+        return calibration_CX1050_AA_14L_batch(R,multip)
     
+    R = R*multip
     T = 0
     if R>= 9825:
-        T = Chebyshev(R,coef_low,ZU_low,ZL_low)
-        warnings.warn("Warning: Temperature below calibrated range")
+        T = Chebyshev(R,_CX1050_COEF_LOW,_CX1050_ZU_LOW,_CX1050_ZL_LOW)
+        _warn("Warning: Temperature below calibrated range")
     elif R<9825 and R>=689.3:
-        T = Chebyshev(R,coef_low,ZU_low,ZL_low)
+        T = Chebyshev(R,_CX1050_COEF_LOW,_CX1050_ZU_LOW,_CX1050_ZL_LOW)
     elif R<689.3 and R>=189.3:
-        T = Chebyshev(R,coef_middle,ZU_middle,ZL_middle)
+        T = Chebyshev(R,_CX1050_COEF_MIDDLE,_CX1050_ZU_MIDDLE,_CX1050_ZL_MIDDLE)
     elif R<189.3 and R>=54.31:
-        T = Chebyshev(R,coef_high,ZU_high,ZL_high)
+        T = Chebyshev(R,_CX1050_COEF_HIGH,_CX1050_ZU_HIGH,_CX1050_ZL_HIGH)
     else:
-        T = Chebyshev(R,coef_high,ZU_high,ZL_high)
-        warnings.warn("Warning: Temperature above calibrated range")
+        T = Chebyshev(R,_CX1050_COEF_HIGH,_CX1050_ZU_HIGH,_CX1050_ZL_HIGH)
+        _warn("Warning: Temperature above calibrated range")
+    return T
+
+
+def calibration_CX1050_AA_14L_batch(R,multip=1):
+    '''
+    Calibration function for Cernox CX-1050-AA-1.4L sensor for arrays
+
+    Parameters
+    ----------
+    R : array(float)
+        Thermometer resistances
+    multip : float
+        Resistance multiplier
+
+    Returns
+    -------
+    T : array(float)
+        Temperatures in Kelvins
+
+    '''
+    R = np.asarray(R,dtype=np.float64)*multip
+    # Evaluate each calibration range with masks
+    m_low = R>=689.3
+    m_middle = (R<689.3) & (R>=189.3)
+    m_high = ~(m_low | m_middle)
+    # CX1050 fit gives temperature directly, not its logarithm
+    logR = np.log10(R)
+    T = np.empty_like(logR)
+    for mask,coef,ZU,ZL in ((m_low,_CX1050_COEF_LOW,_CX1050_ZU_LOW,_CX1050_ZL_LOW),
+                            (m_middle,_CX1050_COEF_MIDDLE,_CX1050_ZU_MIDDLE,_CX1050_ZL_MIDDLE),
+                            (m_high,_CX1050_COEF_HIGH,_CX1050_ZU_HIGH,_CX1050_ZL_HIGH)):
+        k = (2*logR[mask]-(ZU+ZL))/(ZU-ZL)
+        T[mask] = np.polynomial.chebyshev.chebval(k,coef)
+    if np.any(R>=9825):
+        _warn("Warning: Temperature below calibrated range")
+    if np.any(R<54.31):
+        _warn("Warning: Temperature above calibrated range")
     return T
          
 
@@ -163,7 +645,8 @@ def calibration_dipstick_new(R,multip = 1):
     '''
     Calibration function for Koirankoppi dipstick temperature sensor
     
-    Slow code that is here for backwards compatibility
+    Scalar variant that is here for backwards compatibility, use
+    calibration_dipstick for arrays
     
     Calibrated January 2022 by Aki Ruhtinas
     email: aki.ruhtinas@gmail.com
@@ -181,80 +664,8 @@ def calibration_dipstick_new(R,multip = 1):
         Calculated temperature
 
     '''
-    # Correct resistance with multiplier
-    R = R*multip
-    
-    # Calibration between 4.2 K and 18.087 K
-    # 9816 ohms to 1030.73 ohms
-    coef_l = [1.0305706890196387,
-            -0.44538638729688446,
-            0.038245646079858205,
-            0.00040965728900122016,
-            -0.0012118796335522266,
-            0.00016675566193886398,
-            -0.0003134743277859895,
-            -4.9862349494365405e-05,
-            -0.0002538643045723284,
-            2.930529810139165e-05,
-            0.00010177604830833634,
-            ]
-    domain_l = [2.72290035,3.99196185]
-    pl = np.polynomial.Chebyshev(coef_l,domain = domain_l, window = [-1,1])
-    
-    
-    # Calibration between 18.087 K - 107.681 K
-    # 1030.73 ohms to 143.125 ohms
-    coef_m = [1.7681898764629274,
-            -0.5246006794490299,
-            -0.0009736793484812508,
-            0.003478858170366785,
-            0.0008144241470007147,
-            0.00010086660798327552,
-            -0.0002057511678956854,
-            -1.0562017354248726e-05,
-            0.00021521449198016844,
-            -0.0003566476960957493,
-            -0.00031293753057890167,
-            ]
-    domain_m = [1.86381739,3.02540734]
-    pm = np.polynomial.Chebyshev(coef_m,domain = domain_m, window = [-1,1])
-    
-    
-    # Calibration between 107.681 K - 295.3 K
-    # 143.125 ohms to 45.775 ohms
-    coef_h =[2.2479945607783676,
-            -0.220244799396414,
-            0.0001736586172434195,
-            -0.0014264062220913924,
-            0.00016439143464969143,
-            -0.00015075504768659046,
-            -7.754154576623546e-05,
-            -0.00011707662585304951,
-            -2.3972858842214167e-05,
-            -0.00010280191330409421,
-            -5.983916339295706e-06,
-            ]
-    domain_h = [1.66062417,2.16173695]
-    ph = np.polynomial.Chebyshev(coef_h,domain = domain_h, window = [-1,1])
-    
-    T = 0
-    if R>= 9816:
-        T = 10**pl(np.log10(R))
-        #warnings.warn("Warning: Temperature below calibrated range")
-    elif R<9816 and R>=1030.73:
-        T = 10**pl(np.log10(R))
-    elif R<1030.73 and R>=143.125:
-        T = 10**pm(np.log10(R))
-    elif R<143.125 and R>=45.775:
-        T = 10**ph(np.log10(R))
-    else:
-        T = 10**ph(np.log10(R))
-        #warnings.warn("Warning: Temperature above calibrated range")
-    # Check that temperature is reasonable, and if not return zero
-    if 0<T<400:
-        return T
-    else:
-        return 0
+    # Correct resistance with multiplier and evaluate compiled kernel
+    return _dipstick_scalar(float(R*multip))
 
 
 def calibration_dipstick(R):
@@ -272,58 +683,20 @@ def calibration_dipstick(R):
     Returns
     -------
     T : float
-        Calculated temperature
+        Calculated temperature, NaN for resistances outside 40-10000 ohms
 
     '''       
-    # Compute with numpy piecewise function to increase computation speed
-    T= np.piecewise(R, [R>=1030.73, (1030.73 > R) & (R>=143.125), R<143.125],
-                    [lambda x:10**np.polynomial.Chebyshev(
-                                [1.0305706890196387,
-                                -0.44538638729688446,
-                                0.038245646079858205,
-                                0.00040965728900122016,
-                                -0.0012118796335522266,
-                                0.00016675566193886398,
-                                -0.0003134743277859895,
-                                -4.9862349494365405e-05,
-                                -0.0002538643045723284,
-                                2.930529810139165e-05,
-                                0.00010177604830833634,
-                                ],
-                        domain = [2.72290035,3.99196185],
-                        window = [-1,1])(np.log10(x)),
-                     lambda x: 10**np.polynomial.Chebyshev(
-                             [1.7681898764629274,
-                             -0.5246006794490299,
-                             -0.0009736793484812508,
-                             0.003478858170366785,
-                             0.0008144241470007147,
-                             0.00010086660798327552,
-                             -0.0002057511678956854,
-                             -1.0562017354248726e-05,
-                             0.00021521449198016844,
-                             -0.0003566476960957493,
-                             -0.00031293753057890167,
-                             ],domain = [1.86381739,3.02540734], 
-                             window = [-1,1])(np.log10(x)),
-                     lambda x:10**np.polynomial.Chebyshev(
-                             [2.2479945607783676,
-                             -0.220244799396414,
-                             0.0001736586172434195,
-                             -0.0014264062220913924,
-                             0.00016439143464969143,
-                             -0.00015075504768659046,
-                             -7.754154576623546e-05,
-                             -0.00011707662585304951,
-                             -2.3972858842214167e-05,
-                             -0.00010280191330409421,
-                             -5.983916339295706e-06,
-                             ],
-                             domain = [1.66062417,2.16173695],
-                             window = [-1,1])(np.log10(x))]
-                    )
-    # Make sure values are within reasonable range
-    return np.clip(T,4,350)
+    R = np.asarray(R,dtype=np.float64)
+    # Resistances outside calibrated range are marked with NaN, so that
+    # sensor faults are not mistaken for valid temperatures
+    valid = (R>=40) & (R<=10000)
+    T = np.full(R.shape,np.nan)
+    T[valid] = _piecewise_calibration(R[valid],_DIPSTICK_BOUNDS,
+                                      _DIPSTICK_COEFS,_DIPSTICK_DOMAINS)
+    # Make sure values are within reasonable range, clipped in place since
+    # T is a fresh array, [()] returns scalar for scalar input
+    np.clip(T,4,350,out=T)
+    return T[()]
 
     
 
@@ -334,48 +707,48 @@ def calibration_Ling(R,multip=1):
 
     Parameters
     ----------
-    R : float
+    R : float or array(float)
         Thermometer resistance
     **kwargs : 
         'multip', resistance multiplier
 
     Returns
     -------
-    T : float
+    T : float or array(float)
         Calculated temperature
 
     '''
+    if not np.isscalar(R):
+        return calibration_Ling_batch(R,multip)
     # Correct resistance with multiplier and move to logspace
     R = R*multip
-    
-    # Calibration between 40 mK and 20K
-    coef_ling = [-5.30606160e-01, 
-            -1.20610503e+00, 
-            3.99019199e-01, 
-            -1.75532773e-01,
-            1.14216706e-01, 
-            -7.73419751e-02, 
-            5.40618959e-02, 
-            -3.86658100e-02,
-            2.85303341e-02,
-            -2.16080176e-02, 
-            1.63169093e-02,
-            -1.29182752e-02,
-            1.06184792e-02,
-            -7.98300833e-03,
-            6.02191244e-03,
-            -4.32414907e-03,
-            3.41879026e-03, 
-            -2.75739361e-03, 
-            2.04716983e-03, 
-            -1.22720374e-03,
-            5.69061400e-04
-            ]
-    domain_ling = [3.0204657, 5.17597456]
-    
-    plling = np.polynomial.Chebyshev(coef_ling,domain = domain_ling,window = [-1,1])
-    
-    return 10**plling(np.log10(R))
+    if R > 0:
+        # Single readings use math functions to avoid numpy ufunc overhead
+        logT = _cheb_log10(math.log10(R),_LING_COEF,_LING_DOMAIN)
+        # Far outside calibration 10**logT overflows, give inf like numpy
+        return math.pow(10.0,logT) if logT < 308 else math.inf
+    return pow10(_LING_POLY(np.log10(R)))
+
+
+def calibration_Ling_batch(R,multip=1):
+    '''
+    Ling calibration function for arrays
+
+    Parameters
+    ----------
+    R : array(float)
+        Thermometer resistances
+    multip : float
+        Resistance multiplier
+
+    Returns
+    -------
+    T : array(float)
+        Calculated temperatures
+
+    '''
+    R = np.asarray(R,dtype=np.float64)*multip
+    return pow10(_LING_POLY(np.log10(R)))
 
 
 def calibration_Kanada(R,multiplier):
@@ -393,20 +766,35 @@ def calibration_Kanada(R,multiplier):
         Temperature in kelvins
 
     '''
-    out = 0
     if R is None:
         return 0
-    if hasattr(R, "__len__"):
-        # Correct resistance value in Ohms
-        R = np.array(R)*multiplier
-        Nr = len(R)
-        out = np.zeros(Nr)
-        for i in range(Nr):
-            out[i] = calibration_Kanada_func(R[i])
-    else:
-        R = R*multiplier
-        out = calibration_Kanada_func(R)
-    return out
+    # Single positive readings are evaluated with the compiled kernel
+    if np.isscalar(R) and R*multiplier > 0:
+        return _kanada_scalar(float(R*multiplier))
+    return calibration_Kanada_batch(R,multiplier)
+
+
+def calibration_Kanada_batch(R,multiplier=1):
+    '''
+    Kanada calibration for arrays
+
+    Parameters
+    ----------
+    R : array(float)
+        Resistance values to be converted to temperatures
+    multiplier : float
+        Resistance multiplier
+
+    Returns
+    -------
+    out : array(float)
+        Temperature in kelvins
+
+    '''
+    # Correct resistance value in Ohms, scalars stay scalars
+    R = np.asarray(R,dtype=np.float64)*multiplier
+    # Calibration function is vectorized, so no loop over the values
+    return calibration_Kanada_func(R)
 
 def calibration_Kanada_lowtemp_2022(R,multiplier):
     '''
@@ -414,7 +802,7 @@ def calibration_Kanada_lowtemp_2022(R,multiplier):
     Calibration valid from 15 K to 1.5 K
     Parameters
     ----------
-    R : float
+    R : array or float
         Resistance
     multiplier : float
         Resistance multiplier
@@ -425,29 +813,12 @@ def calibration_Kanada_lowtemp_2022(R,multiplier):
         Calculated temperature
 
     '''
-    if hasattr(R, "__len__"):
-        # Correct resistance value in Ohms
-        R = np.array(R)*multiplier
-    else:
-        R = R*multiplier
-        
-    coef_0 = [4.837741078001092,
-            -5.0386618786563675,
-            2.6011253829600314,
-            -1.2811240931100099,
-            0.6202351699537209,
-            -0.290718100542933,
-            0.13446140588234368,
-            -0.06110535096065962,
-            0.027152555428268582,
-            -0.010518962898060267,
-            0.006875088171212802,
-            -0.0025596374495960084
-            ]
-    domain_0 = [268.137, 1202.448]
-    # Define Chebyshev polynomial
-    ph = np.polynomial.Chebyshev(coef_0,domain = domain_0, window = [-1,1])
-    return ph(R)
+    # Single readings are evaluated with the compiled kernel
+    if np.isscalar(R):
+        return _kanada_lt_scalar(float(R*multiplier))
+    # Correct resistance value in Ohms, scalars stay scalars
+    R = np.asarray(R,dtype=np.float64)*multiplier
+    return _KANADA_LT_POLY(R)
            
 def calibration_Kanada_func(R):   
     '''
@@ -457,48 +828,17 @@ def calibration_Kanada_func(R):
     ========================================================
     '''
     
-    '''
-    Chebyshev coefficents for different temperature ranges
-    '''
-    coef_m = [107.6682289065,
-              -169.5447785940,
-              86.4765089174,
-              -28.0981575764,
-              6.1235649200,
-              -1.9503945254,
-              1.0131764357,
-              -0.2848764539,
-              0.0754777049,
-              -0.1217169204,
-              0.0183919674
-              ]
-    ZU_m = 3.0937542834
-    ZL_m = 1.5133641164
-    
-    coef_l = [ 6.8642361690,
-              -7.6201321296,
-              2.9185476218,
-              -0.8169479610,
-              0.1364804787,
-              0.0336174734,
-              -0.0445366064,
-              0.0282235691,
-              -0.0018566792,
-              -0.0065261097,
-              0.0115414837
-              ]
-    ZL_l = 2.3746383841
-    ZU_l = 3.0937542834
-    
-    # Calculation of temperatures using calibration equation
-    T=0
-    if 287.6046 <= R:
-        # Low temperature calibration
-        T = Chebyshev(R,coef_l,ZU_l,ZL_l)
-    else:
-        # Middle temperature calibration
-        T = Chebyshev(R,coef_m,ZU_m,ZL_m)
-    return T
+    # Calculation of temperatures using calibration equation,
+    # log10 of resistance is shared by both ranges
+    Z = np.log10(R)
+    # Low temperature calibration
+    T_l = np.polynomial.chebyshev.chebval((2*Z-(_KANADA_ZU_L+_KANADA_ZL_L))/(_KANADA_ZU_L-_KANADA_ZL_L),
+                                           _KANADA_COEF_L)
+    # Middle temperature calibration
+    T_m = np.polynomial.chebyshev.chebval((2*Z-(_KANADA_ZU_M+_KANADA_ZL_M))/(_KANADA_ZU_M-_KANADA_ZL_M),
+                                           _KANADA_COEF_M)
+    # Select range for each value, [()] returns scalar for scalar input
+    return np.where(287.6046 <= R,T_l,T_m)[()]
 
 def calibration_morso(R,multiplier):
     '''
@@ -513,123 +853,66 @@ def calibration_morso(R,multiplier):
     calibration between 260 K and  290 K -> Second calibration
     Parameters
     ----------
-    R : float
+    R : float or array(float)
         Thermometer resistance
     multiplier : int
         Resistance bridge multiplier to correct resistance to ohms
 
     Returns
     -------
-    T : float
+    T : float or array(float)
         Temperature in Kelvins
 
     '''
 
-    # Correct resistance with multiplier and move to logspace
-    R = R*multiplier
-    
-     # Calibration between 4.2 K and 20 K
-    # domain between 3070.9799999999996 ohms to 626.8690000000003 ohms
-
-    coef_l = [0.9506674308499167,
-            -0.35199927764236455,
-            0.016258403822749814,
-            0.0055715910387260014,
-            0.0008861267363886899,
-            -0.0005390646317558515,
-            0.00046234441088706396,
-            -0.00034663919545294743,
-            1.8900818521904524e-05,
-            -0.0006577629496062799,
-            -0.0010153963072063212
-            ]
-    domain_l = [2.79717679, 3.48727699]
-    pl = np.polynomial.Chebyshev(coef_l,domain = domain_l, window = [-1,1])
-    
-    
-    # Calibration between 20 K - 70 K
-    # domain between 629.86 to  221.75ohms
-    coef_m = [1.57422337136405,
-            -0.2644571720191467,
-            0.0018751976846375657,
-            0.00015485832655411989,
-            0.0002687387319480107,
-            0.00042994288778457724,
-            0.0001854343092784725,
-            0.000677677389021527,
-            2.7489387520667344e-05,
-            -6.839382864240871e-05,
-            0.00013297037462381675
-            ]
-    domain_m = [2.34587734, 2.79924403]
-    pm = np.polynomial.Chebyshev(coef_m,domain = domain_m, window = [-1,1])
-    
-    
-    # Calibration between 70 K - 260 K
-    # domain between 252.52599 ohms to 64.0478 ohms
-    coef_h =[2.105907955347509,
-            -0.32561185605929055,
-            -0.00452466867832195,
-            -0.0041969745056598,
-            0.002813068419108741,
-            -0.0012856814956658373,
-            0.001022107637142309,
-            -0.0008692536680943596,
-            0.0005275420860334051,
-            -0.0007986614863778288,
-            0.0004594498328113981,
-            ]
-    domain_h = [1.80650422, 2.4023061 ]
-    ph = np.polynomial.Chebyshev(coef_h,domain = domain_h, window = [-1,1])
-    
-    #Calibration between 260 K - 293 K
-    #Domain between 58.184299999999986 ohm to 73.04270000000002 ohm
-    coef_uh=[2.419846561814242,
-    -0.05110237731635884,
-    -0.00032812984876488935,
-    0.00019824559266527853,
-    -0.0009580047292876272,
-    0.0004420826699351031,
-    -0.00031778576498260353,
-    9.294972361020348e-05,
-    0.0002128491379170427,
-    -7.140389360008976e-05,
-    -9.114398708705641e-05
-    ]
-    
-    domain_uh = [1.7648058138045555,1.8635768183793173]
-    puh = np.polynomial.Chebyshev(coef_uh,domain = domain_uh, window = [-1,1])
-    
-    T = 0
-    if R>= 3071:
-        T = 10**pl(np.log10(R))
-        warnings.warn("Warning: Temperature below calibrated range")
-    elif R<3071 and R>=620.847233906399:#low, crossing point between low and mid, though domain is in 626 for low
-        T = 10**pl(np.log10(R))
-    elif R<620.847233906399 and R>=224.38862779880543:#mid, mid high has a close crossing near mid domain 221
-        T = 10**pm(np.log10(R))
-    elif R<224.38862779880543 and R>=64.04780000000001:#high
-        T = 10**ph(np.log10(R))
-    elif R<64.04780000000001 and R>=58:
-        T=10**puh(np.log10(R))
-    else:
-        T = 10**ph(np.log10(R))#above high
-        warnings.warn("Warning: Temperature above calibrated range")
-    
-    # Check that temperature is reasonable, and if not return zero
-    if 0<T<400:
-        return T
-    else:
-        return 0
+    if not np.isscalar(R):
+        return calibration_morso_batch(R,multiplier)
+
+    # Correct resistance with multiplier and evaluate compiled kernel
+    T, flag = _morso_scalar(float(R*multiplier))
+    if flag < 0:
+        _warn("Warning: Temperature below calibrated range")
+    elif flag > 0:
+        _warn("Warning: Temperature above calibrated range")
+    return T
+
+
+def calibration_morso_batch(R,multiplier=1):
+    '''
+    morso calibration for arrays, see calibration_morso
+
+    Parameters
+    ----------
+    R : array(float)
+        Thermometer resistances
+    multiplier : int
+        Resistance bridge multiplier to correct resistance to ohms
+
+    Returns
+    -------
+    T : array(float)
+        Temperatures in Kelvins
+
+    '''
+    R = np.asarray(R,dtype=np.float64)*multiplier
+    T = _piecewise_calibration(R,_MORSO_BOUNDS,_MORSO_COEFS,_MORSO_DOMAINS)
+    if np.any(R>=3071):
+        _warn("Warning: Temperature below calibrated range")
+    if np.any(R<58):
+        _warn("Warning: Temperature above calibrated range")
+    # Check that temperatures are reasonable, and if not set them to zero
+    T[~((T>0) & (T<400))] = 0
+    return T
 
 
 def Chebyshev(R,coef,ZU,ZL):
     '''
-    Chebyshev function for calibration equations
+    Chebyshev function for calibration equations. Series is evaluated with
+    Clenshaw recurrence, so R can also be an array.
 
     Parameters
     ----------
-    R : float
+    R : float or array(float)
         Resistance in ohms
     coef : array(float)
         Chebyshev coefficents
@@ -640,16 +923,17 @@ def Chebyshev(R,coef,ZU,ZL):
 
     Returns
     -------
-    T : float
+    T : float or array(float)
         Temperature in kelvins
 
     '''
-    T = 0
-    Z = np.log10(np.longdouble(R))
-    k = ((Z-ZL)-(ZU-Z))/(ZU-ZL)
-    for i in range(len(coef)):
-        T+=np.longdouble(coef[i])*np.cos(i*np.arccos(np.longdouble(k)))
-    return T
+    if np.isscalar(R) and R > 0:
+        # Single readings use math functions to avoid numpy ufunc overhead
+        return _cheb_log10(math.log10(R),np.asarray(coef,dtype=np.float64),
+                           (float(ZL),float(ZU)))
+    # Map log10 resistance to Chebyshev window [-1,1]
+    k = (2*np.log10(R)-(ZU+ZL))/(ZU-ZL)
+    return np.polynomial.chebyshev.chebval(k,coef)
     
     
 if __name__ == '__main__':
@@ -667,6 +951,7 @@ if __name__ == '__main__':
     dt2 = perf_counter() - t3
     print(dt2)
     
+    import matplotlib.pyplot as plt
     plt.figure()
     plt.semilogx(r,T,'b-')
     plt.semilogx(r,T2,'r-')
@@ -15,33 +15,86 @@ from pymodules.realTimeGraph_v6 import realTimeGraph
 from pymodules.NiDAQmx_control import *
 from pymodules.instrument_control import *
 from pymodules.thermometer_calib import *
+from pymodules.meas_utils import H5Logger, pinProcess, njit
 import uuid
-from scipy.signal import *
 
 from PyQt5 import QtWidgets
-import matplotlib.pyplot as plt
 import numpy as np
 import time
 import multiprocessing as mp
 import traceback
-import h5py
 import signal
 
 
+@njit(cache=True,fastmath=True,error_model='numpy')
+def reduce_channels(out,Gi,Gv,Rtemp_ch,Ilockin_ch,Vlockin_ch,sens_I,sens_V):
+    '''
+    Average DAQ channels and calculate lock-in current, voltage and
+    resistance in one compiled call
+
+    Parameters
+    ----------
+    out : array
+        DAQ data, size (channels) x (samples)
+    Gi : float
+        Current preamplifier gain
+    Gv : float
+        Voltage preamplifier gain
+    Rtemp_ch : int
+        Thermometer channel index
+    Ilockin_ch : int
+        Current lock-in amplifier channel index
+    Vlockin_ch : int
+        Voltage lock-in amplifier channel index
+    sens_I : float
+        Current lock-in amplifier sensitivity in volts
+    sens_V : float
+        Voltage lock-in amplifier sensitivity in volts
+
+    Returns
+    -------
+    Rtemp, Ilockin, Vlockin, I, V, R : float
+        Thermometer reading, raw lock-in outputs, current in amperes,
+        voltage in volts and resistance in ohms
+
+    '''
+    Rtemp = out[Rtemp_ch].mean()
+    Ilockin = out[Ilockin_ch].mean()
+    Vlockin = out[Vlockin_ch].mean()
+    # Calculate current in amperes
+    I = (Ilockin*Gi*sens_I)/10.0
+    # Calculate voltage in volts
+    V = ((Vlockin/Gv)*sens_V)/10.0
+    # Calculate measured resistance in ohms
+    return Rtemp, Ilockin, Vlockin, I, V, V/I
+
+
 class lockinRMeas():
     '''
     Class to test python measurement environment functionalities
     '''
+    # Thermometer calibration functions by calibration name
+    _THERM_FNS = {"Dipstick_old": calibration_dipstick_old,
+                  "Dipstick": calibration_dipstick_new,
+                  "Kanada_old": calibration_Kanada,
+                  "Kanada": calibration_Kanada_lowtemp_2022,
+                  "Ling": calibration_Ling,
+                  }
+    
     def __init__(self):
         self.channels=["Dev1/ai0","Dev1/ai1","Dev1/ai2"]  # Channels to read
         self.Nsamples = 1000 # Number of samples per each point
+        self.oversample = 1 # Number of points collected with one DAQ request
         self.sample_rate = 5e4 # DAQ card sampling rate
         self.settling_time = 15e-3 # Settling time after param setting
-        self.wait_time = 10e-3 # Wait 10 ms between runs
+        self.wait_time = 10e-3 # Minimum period of acquisition iterations, 10 ms
         
         self.sens_change_wait = 100e-3 # Waiting time after lock-in sensitivity hase changed
         
         self.closeAtExit = False
+        self.ui_update_interval = 1/30 # Minimum time between metadata updates to UI
+        self.log_flush_interval = 1.0 # Maximum time buffered rows wait before they are written to log file
+        self.worker_cpu = None # CPU core for the acquisition process, None lets OS decide
         self.exit  = False
                 
         self.N = 0 # Number of collected datapoints
@@ -49,6 +102,7 @@ class lockinRMeas():
         self.filename = "temp.txt"
         
         self.therm_calib_name = "Dipstick"
+        self._therm_fn = calibration_dipstick_new
         
         # Thermometer calibration
         self.therm_multiplier = 1000
@@ -64,6 +118,7 @@ class lockinRMeas():
         self.Ilockin_ch = 1
         self.Vlockin_ch = 2
         self.autosens = False
+        self._autosens_step = self._noop
         
         self.plot_labels = ['Time(s)','Rtherm ','Current(A) ','Voltage(V) ',
                     'Resistance(Ohm)','Temperature(K)']
@@ -75,14 +130,18 @@ class lockinRMeas():
         self.Gv = 100
                 
         # Set up queues for communication
-        self.q1 = mp.Queue() # Queue for data communication
+        self.q1 = SharedRingQueue(6) # Shared memory ring buffer for data communication
         self.q2 = mp.Queue() # Dictionary queue for metadata
-        self.q3 = mp.Queue() # Queue for data logging
-        self.qin = mp.Queue() # Queue to get data from UI
+        self.qin = PipeQueue() # Pipe to get data from UI
         
         self.start = False
         self.uuid = uuid.uuid4()
         self.fname = None
+        # Data row: time, Rtherm, I, V, R, T, raw current and raw voltage
+        self._row = np.empty(8)
+        self._fh = None # Log file handle
+        self.hdf5 = False # Log data to compressed HDF5 file fname+'.h5' instead of text
+        self._h5 = None # H5Logger, created on first write
         self.lockin1_online = False
         self.lockin2_online = False
         
@@ -178,8 +237,15 @@ class lockinRMeas():
         None.
 
         '''
+        # Keep acquisition process on one core
+        pinProcess(self.worker_cpu)
         while not self.start:
             self.processIncomingData()              
+        # Select thermometer calibration and autosens step, these may have been set directly
+        self.setThermCalib()
+        self.setAutosens()
+        # Terminating the process raises SystemExit, so that the log file is closed below
+        signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit())
         # Get available instruments
         instruments = self.getInstruments()
         # Wait until both lockins are connected
@@ -205,101 +271,114 @@ class lockinRMeas():
         instruments['Vlockin'].export_settings(self.pathname + self.filename + "_settings_Vlockin.yml")
         instruments['Ilockin'].export_settings(self.pathname + self.filename + "_settings_Ilockin.yml")
         
-        # Wait one second before starting measurement
-        time.sleep(1)
+        # Wait until voltage lock-in amplifier has locked to the reference, at most one second
+        t_lock = time.perf_counter()
+        while not instruments['Vlockin'].is_locked() and time.perf_counter()-t_lock < 1:
+            time.sleep(0.02)
+        # Let outputs settle before starting measurement
+        time.sleep(self.settling_time)
         
         # Get starting time for measurement
         starttime=time.perf_counter()
         # Initialize arrays for data collection
-        self.out = np.empty(shape=(len(self.channels),self.Nsamples))
-        data = []
+        self.allocateOutput()
         self.N = 0
         # Initialize DAQ control class
         self.daq = DAQcontrol(self.channels)
+        # Compile reduction kernel for block views before the measurement starts
+        reduce_channels(self.out.reshape(len(self.channels),self.oversample,self.Nsamples)[:,0,:],
+                        float(self.Gi),float(self.Gv),self.Rtemp_ch,self.Ilockin_ch,self.Vlockin_ch,1.0,1.0)
         iter_time = 1
+        # Deadline of the previous iteration for pacing the loop
+        next_deadline = time.perf_counter()
+        # Time when metadata is sent to UI next time
+        next_ui_update = next_deadline
+        # Time when log file is flushed next time
+        next_flush = next_deadline+self.log_flush_interval
+        # Labels of the data columns, written to the log file before the first row
+        datalabels=['#','Time(s) ','R_thermometer ','Current(A) ','Voltage(V) ',
+                    'Resistance(Ohm)','Temperature(K)','Raw current ','Raw voltage']
         # Data acquisition and control loop
-        while True:
-            # Handle communication to main UI
-            self.processIncomingData()
-            while not self.start:
+        try:
+            while True:
+                # Handle communication to main UI
                 self.processIncomingData()
-            # Get timestamp
-            t1=time.perf_counter()
-            timestamp = t1-starttime
-            # Collect data from DAQ card
-            self.daq.request_data(self.out,self.sample_rate,self.Nsamples)          
-            # Get temperature
-            Rtemp = np.average(self.out[self.Rtemp_ch])
-            # Calculate temperature
-            T=0
-            if self.therm_calib_name == "Dipstick_old":
-                T = calibration_dipstick(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Dipstick":
-                T = calibration_dipstick_new(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Kanada_old":
-                T = calibration_Kanada(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Kanada":
-                T = calibration_Kanada_lowtemp_2022(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Ling":
-                T = calibration_Ling(Rtemp,self.therm_multiplier)
-            else:
-                T = calibration_dipstick_new(Rtemp,self.therm_multiplier)	
-
-
-
-            # Calculate current in amperes
-            Ilockin = np.average(self.out[self.Ilockin_ch])
-            I = (Ilockin*self.Gi*instruments['Ilockin'].get_sens_voltage(instruments['Ilockin'].sens))/10.0
-            # Calculate voltage in volts
-            Vlockin = np.average(self.out[self.Vlockin_ch])
-            V = ((Vlockin/self.Gv)*instruments['Vlockin'].get_sens_voltage(instruments['Vlockin'].sens))/10.0
-            # Calculate measured resistance in ohms
-            R = V/I
-            # Adjust voltage lock-in amplifier sensitivities if autosens is on
-            if self.autosens:
-                if Vlockin > 9.9:
-                    instruments['Vlockin'].set_sens('up')
-                    # Wait voltage to settle
-                    time.sleep(self.sens_change_wait)
-                    print('Lock-in amplifier 2: sensitivity to ',instruments['Vlockin'].sens)
-                if Vlockin < 2.0:
-                    # Get lock-in amplifier sensitivity voltage
-                    vsens_val = instruments['Vlockin'].get_sens_voltage(instruments['Vlockin'].sens)
-                    # Lower sensitivity only to certain limit
-                    if vsens_val > 5e-5:
-                        # Set sensitivity down
-                        instruments['Vlockin'].set_sens('down')
-                        # Wait voltage to settle
-                        time.sleep(self.sens_change_wait)
-                        print('Lock-in amplifier 2: sensitivity to ',instruments['Vlockin'].sens)
-					
-            # Add values to data array
-            datalabels=['#','Time(s) ','R_thermometer ','Current(A) ','Voltage(V) ',
-                        'Resistance(Ohm)','Temperature(K)','Raw current ','Raw voltage']
-            
-            data=[t1-starttime]
-            # Put all of the data to data array
-            for di in [Rtemp, I, V, R, T, Ilockin, Vlockin]:
-                data.append(di)
-            # Transfer data to queue and select what to plot
-            self.q1.put([timestamp,Rtemp, I*self.plot_Iunit_multip, V*self.plot_Vunit_multip, R,T])
-            # Write data to a file
-            if self.N == 0:
-                self.dataLogger('# UUID '+str(self.uuid),spaces = False)
-                # Write down datalabels for first iteration
-                self.dataLogger(datalabels)
-            self.dataLogger(data)
-            # Construct metadata queue
-            self.q2.put({"Npoints" : self.N, 
-                         "Temperature": T, 
-                         "Freq": str(np.around(1/iter_time,decimals=2))+" Hz",
-                         })
-            # Time between iterations
-            time.sleep(self.wait_time)
-            # Calculate iteration time
-            t2 = time.perf_counter()
-            iter_time = abs(t1-t2)
-            self.N+=1
+                while not self.start:
+                    self.processIncomingData()
+                # Get timestamp
+                t1=time.perf_counter()
+                timestamp = t1-starttime
+                # Collect data for oversample points from DAQ card with one request
+                self.daq.read_data(self.out,self.sample_rate,self.oversample*self.Nsamples)
+                # Get cached lock-in amplifier sensitivities used for this request
+                sens_I = float(instruments['Ilockin'].sens_volt)
+                sens_V = float(instruments['Vlockin'].sens_volt)
+                # View data as blocks of Nsamples, one block per point
+                blocks = self.out.reshape(len(self.channels),self.oversample,self.Nsamples)
+                for j in range(self.oversample):
+                    # Average channels and calculate current, voltage and resistance
+                    Rtemp, Ilockin, Vlockin, I, V, R = reduce_channels(
+                        blocks[:,j,:],float(self.Gi),float(self.Gv),self.Rtemp_ch,self.Ilockin_ch,self.Vlockin_ch,
+                        sens_I,sens_V)
+                    # Calculate temperature
+                    T = self._therm_fn(Rtemp,self.therm_multiplier)
+                
+                    # Timestamp of the block
+                    timestamp_j = timestamp+j*self.Nsamples/self.sample_rate
+                    # Put all of the data to data row
+                    data = self._row
+                    data[0] = timestamp_j
+                    data[1] = Rtemp
+                    data[2] = I
+                    data[3] = V
+                    data[4] = R
+                    data[5] = T
+                    data[6] = Ilockin
+                    data[7] = Vlockin
+                    # Transfer data to queue and select what to plot
+                    self.q1.put([timestamp_j,Rtemp, I*self.plot_Iunit_multip, V*self.plot_Vunit_multip, R,T])
+                    # Write data to a file
+                    if self.N == 0:
+                        self.dataLogger('# UUID '+str(self.uuid),spaces = False)
+                        # Write down datalabels for first iteration
+                        self.dataLogger(datalabels)
+                    self.dataLogger(data)
+                    # Flush log file every 64 points
+                    if self.N % 64 == 0:
+                        self.flushLogFile()
+                    self.N+=1
+                # Flush log file also by time, so that slow measurements do not keep rows in buffer
+                if t1 >= next_flush:
+                    next_flush = t1+self.log_flush_interval
+                    self.flushLogFile()
+                # Construct metadata queue for the last point, UI only shows the latest
+                # values so updates are limited to its refresh rate
+                if t1 >= next_ui_update:
+                    next_ui_update = t1+self.ui_update_interval
+                    self.q2.put({"Npoints" : self.N-1, 
+                                 "Temperature": T, 
+                                 "Freq": "{:.2f} Hz".format(1.0/iter_time),
+                                 })
+
+                # Adjust voltage lock-in amplifier sensitivities if autosens is on,
+                # done after the whole request so that all blocks share the same sensitivity
+                self._autosens_step(Vlockin,instruments)
+                # Wait until deadline of the next iteration to keep steady cadence
+                next_deadline += self.wait_time
+                dt = next_deadline-time.perf_counter()
+                if dt > 0:
+                    time.sleep(dt)
+                else:
+                    # Iteration ran late, restart cadence from now instead of catching up
+                    next_deadline -= dt
+                # Calculate time per point
+                t2 = time.perf_counter()
+                iter_time = abs(t1-t2)/self.oversample
+        finally:
+            # Write buffered rows and close log file however the loop ends
+            self.closeLogFile()
+            # Release persistent DAQ task
+            self.daq.close_reader()
             
         # close plotting window at exit
         if self.closeAtExit:
@@ -307,6 +386,79 @@ class lockinRMeas():
             self.q1.put('Exit')
         sys.exit()
          
+    def allocateOutput(self):
+        '''
+        Allocate DAQ output array for oversample x Nsamples samples per channel.
+        AnalogMultiChannelReader only reads into C-contiguous float64 arrays,
+        so the reductions work on float64 too
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.out = np.empty(shape=(len(self.channels),self.oversample*self.Nsamples),dtype=np.float64,order='C')
+        
+    def setAutosens(self):
+        '''
+        Select sensitivity adjustment step of the measurement loop according
+        to autosens, so that the loop does not check the flag every iteration
+
+        Returns
+        -------
+        None.
+
+        '''
+        self._autosens_step = self.adjustSensitivity if self.autosens else self._noop
+        
+    def _noop(self,*args):
+        pass
+        
+    def adjustSensitivity(self,Vlockin,instruments):
+        '''
+        Adjust voltage lock-in amplifier sensitivity when output is near
+        the ends of the range
+
+        Parameters
+        ----------
+        Vlockin : float
+            Voltage lock-in amplifier output read by DAQ, volts
+        instruments : dict
+            Connected instruments
+
+        Returns
+        -------
+        None.
+
+        '''
+        if Vlockin > 9.9:
+            instruments['Vlockin'].set_sens('up')
+            # Wait voltage to settle
+            time.sleep(self.sens_change_wait)
+            print('Lock-in amplifier 2: sensitivity to ',instruments['Vlockin'].sens)
+        if Vlockin < 2.0:
+            # Get lock-in amplifier sensitivity voltage
+            vsens_val = instruments['Vlockin'].sens_volt
+            # Lower sensitivity only to certain limit
+            if vsens_val > 5e-5:
+                # Set sensitivity down
+                instruments['Vlockin'].set_sens('down')
+                # Wait voltage to settle
+                time.sleep(self.sens_change_wait)
+                print('Lock-in amplifier 2: sensitivity to ',instruments['Vlockin'].sens)
+        
+    def setThermCalib(self):
+        '''
+        Select thermometer calibration function according to therm_calib_name,
+        dipstick calibration is used for unknown names
+
+        Returns
+        -------
+        None.
+
+        '''
+        self._therm_fn = self._THERM_FNS.get(self.therm_calib_name,calibration_dipstick_new)
+        
     def processIncomingData(self):
         '''
         Method to process data sent by UI
@@ -335,12 +487,15 @@ class lockinRMeas():
                 self.start = True
             if 'stop' in measParamDict:
                 self.start = False
+                self.flushLogFile()
             if 'autosens' in measParamDict:
                 self.autosens = measParamDict['autosens']
+                self.setAutosens()
                 
             # Get thermometer calibration from GUI
             if 'ThermCalibName' in measParamDict:
                 self.therm_calib_name = str(measParamDict['ThermCalibName'])
+                self.setThermCalib()
                 
                 
             # Get filename from GUI
@@ -357,7 +512,7 @@ class lockinRMeas():
             if 'Nsamples' in measParamDict:
                 self.Nsamples = int(measParamDict['Nsamples'])
                 # Update data array length accordingly
-                self.out = np.empty(shape=(len(self.channels),self.Nsamples))
+                self.allocateOutput()
                 print('Samples/point: ' + str(self.Nsamples))
                 
             print('===========================================================')
@@ -371,16 +526,79 @@ class lockinRMeas():
         None.
 
         '''
+        if self.hdf5:
+            # Open HDF5 file on first write and whenever filename has changed
+            if self._h5 is None or self._h5.filename != self.fname+'.h5':
+                self.closeH5()
+                self._h5 = H5Logger(self.fname+'.h5')
+            self._h5.write(data)
+            return
+        # Open log file on first write and whenever filename has changed
+        if self._fh is None or self._fh.name != self.fname:
+            self.openLogFile()
         # write data to file
-        #self.fname = self.defaultpathname+"\\"+self.filename
-        with open(self.fname,'a+') as f:
-            if spaces:
-                f.write(" ".join(str(item) for item in data))
-                f.write("\n")
-            else:
-                f.write(data)
-                f.write("\n")
-                
+        if isinstance(data,np.ndarray):
+            # Format numeric row with one printf-style call instead of str() per item
+            line = " ".join(["%.12g"]*data.size) % tuple(data.tolist())
+        elif spaces:
+            line = " ".join(map(str,data))
+        else:
+            line = data
+        self._fh.write((line+"\n").encode())
+        
+    def openLogFile(self):
+        '''
+        Open log file for appending with a 64 kB write buffer,
+        previously opened log file is closed
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.closeLogFile()
+        self._fh = open(self.fname,'ab',buffering=1<<16)
+        
+    def flushLogFile(self):
+        '''
+        Write buffered data to the log file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._fh is not None:
+            self._fh.flush()
+        if self._h5 is not None:
+            self._h5.flush()
+        
+    def closeLogFile(self):
+        '''
+        Flush and close the log file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self.closeH5()
+        
+    def closeH5(self):
+        '''
+        Flush and close the HDF5 file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
     
     def Exit(self):
         '''
@@ -13,34 +13,68 @@ from pyDAQ_UI_v1 import realTimeGraph
 from NiDAQmx_control import *
 from instrument_control import *
 from thermometer_calib import *
+from meas_utils import H5Logger, pinProcess, njit, prange
 import nidaqmx
 import uuid
-from scipy.signal import *
 
 from PyQt5 import QtWidgets
-import matplotlib.pyplot as plt
 import numpy as np
 import time
 import multiprocessing as mp
 import traceback
-import h5py
 import signal
 
 
+@njit(parallel=True,fastmath=True,cache=True)
+def batch_means(out3d,result):
+    '''
+    Average each block of each DAQ channel, blocks are reduced in parallel
+
+    Parameters
+    ----------
+    out3d : array
+        DAQ data, size (channels) x (blocks) x (samples)
+    result : array
+        Output array for block means, size (channels) x (blocks)
+
+    Returns
+    -------
+    None.
+
+    '''
+    K = out3d.shape[1]
+    for ij in prange(out3d.shape[0]*K):
+        i = ij // K
+        j = ij % K
+        result[i,j] = out3d[i,j].mean()
+
+
 class pyDAQmeas():
     '''
     Class for data acquisition
     '''
+    # Thermometer calibration functions by calibration name
+    _THERM_FNS = {"Dipstick_old": calibration_dipstick_old,
+                  "Dipstick": calibration_dipstick_new,
+                  "Kanada_old": calibration_Kanada,
+                  "Kanada": calibration_Kanada_lowtemp_2022,
+                  "Ling": calibration_Ling,
+                  }
+    
     def __init__(self):
         self.channels=["Dev1/ai0","Dev1/ai1","Dev1/ai2"]  # Channels to read
         self.Nsamples = 1000 # Number of samples per each point
+        self.oversample = 1 # Number of points collected with one DAQ request
         self.sample_rate = 5e4 # DAQ card sampling rate
         self.settling_time = 15e-3 # Settling time after param setting
-        self.wait_time = 10e-3 # Wait 10 ms between runs
+        self.wait_time = 10e-3 # Minimum period of acquisition iterations, 10 ms
         
         self.sens_change_wait = 100e-3 # Waiting time after lock-in sensitivity hase changed
         
         self.closeAtExit = False
+        self.ui_update_interval = 1/30 # Minimum time between metadata updates to UI
+        self.log_flush_interval = 1.0 # Maximum time buffered rows wait before they are written to log file
+        self.worker_cpu = None # CPU core for the acquisition process, None lets OS decide
         self.exit  = False
                 
         self.N = 0 # Number of collected datapoints
@@ -48,6 +82,7 @@ class pyDAQmeas():
         self.filename = "temp.txt"
         
         self.therm_calib_name = "Dipstick"
+        self._therm_fn = calibration_dipstick_new
         
         self.uuid = uuid.uuid4()
                         
@@ -65,14 +100,16 @@ class pyDAQmeas():
         self.Gv = 100
                 
         # Set up queues for communication
-        self.q1 = mp.Queue() # Queue for data communication
+        self.q1 = SharedRingQueue(65) # Shared memory ring buffer for data, time + up to 64 channels
         self.q2 = mp.Queue() # Dictionary queue for metadata
-        self.q3 = mp.Queue() # Queue for data logging
-        self.qin = mp.Queue() # Queue to get data from UI
+        self.qin = PipeQueue() # Pipe to get data from UI
         
         self.start = False
         
         self.fname = None
+        self._fh = None # Log file handle
+        self.hdf5 = False # Log data to compressed HDF5 file fname+'.h5' instead of text
+        self._h5 = None # H5Logger, created on first write
         
         self.setup_data_collection = True
         
@@ -131,73 +168,96 @@ class pyDAQmeas():
         None.
 
         '''
+        # Keep acquisition process on one core
+        pinProcess(self.worker_cpu)
         while not self.start:
             self.processIncomingData()              
+        # Select thermometer calibration, name may have been set directly
+        self.setThermCalib()
+        # Terminating the process raises SystemExit, so that the log file is closed below
+        signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit())
         # Get starting time for measurement
         starttime=time.perf_counter()
         # Initialize data collection
         self.initDataCollection()
-        data = []
         self.N = 0
         iter_time = 1
+        # Deadline of the previous iteration for pacing the loop
+        next_deadline = time.perf_counter()
+        # Time when metadata is sent to UI next time
+        next_ui_update = next_deadline
+        # Time when log file is flushed next time
+        next_flush = next_deadline+self.log_flush_interval
         # Data acquisition and control loop
-        while True:
-            # Handle communication to main UI
-            self.processIncomingData()
-            while not self.start:
+        try:
+            while True:
+                # Handle communication to main UI
                 self.processIncomingData()
-            if self.setup_data_collection:
-                self.initDataCollection()
-                data = []
-            # Get timestamp
-            t1=time.perf_counter()
-            timestamp = t1-starttime
-            # Collect data from DAQ card
-            self.daq.request_data(self.out,self.sample_rate,self.Nsamples)          
-            # Get temperature
-            Rtemp = np.average(self.out[self.Rtemp_ch])
-            # Calculate temperature
-            T=0
-            if self.therm_calib_name == "Dipstick_old":
-                T = calibration_dipstick(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Dipstick":
-                T = calibration_dipstick_new(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Kanada_old":
-                T = calibration_Kanada(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Kanada":
-                T = calibration_Kanada_lowtemp_2022(Rtemp,self.therm_multiplier)
-            elif self.therm_calib_name == "Ling":
-                T = calibration_Ling(Rtemp,self.therm_multiplier)
-            else:
-                T = calibration_dipstick_new(Rtemp,self.therm_multiplier)	
-
-            
-            data=[t1-starttime]
-            # Put all of the data to data array
-            for i in range(len(self.out)):
-                data.append(np.average(self.out[i]))
-            # Transfer data to queue and select what to plot
-            self.q1.put(data)
-            # Check if start button is press
-            if self.newstart:
-                # Write down unique identifier for first iteration
-                self.dataLogger('# UUID: '+str(self.uuid),spaces = False)
-                # Write down datalabels for first iteration
-                self.dataLogger(self.plot_labels[:len(self.channels)+1])
-                self.newstart = False
-            # Write data to a file
-            self.dataLogger(data)
-            # Construct metadata queue
-            self.q2.put({"Npoints" : self.N, 
-                         "Temperature": T, 
-                         "Freq": str(np.around(1/iter_time,decimals=2))+" Hz",
-                         })
-            # Time between iterations
-            time.sleep(self.wait_time)
-            # Calculate iteration time
-            t2 = time.perf_counter()
-            iter_time = abs(t1-t2)
-            self.N+=1
+                while not self.start:
+                    self.processIncomingData()
+                if self.setup_data_collection:
+                    self.initDataCollection()
+                # Get timestamp
+                t1=time.perf_counter()
+                timestamp = t1-starttime
+                # Collect data for oversample points from DAQ card with one request
+                self.daq.read_data(self.out,self.sample_rate,self.oversample*self.Nsamples)
+                # Average all channels over blocks of Nsamples, one block per point
+                batch_means(self.out.reshape(len(self.channels),self.oversample,self.Nsamples),self._means)
+                for j in range(self.oversample):
+                    means = self._means[:,j]
+                    # Get temperature
+                    Rtemp = means[self.Rtemp_ch]
+                    # Calculate temperature
+                    T = self._therm_fn(Rtemp,self.therm_multiplier)
+                
+                    # Put timestamp of the block and channel means to data row
+                    data = self._row
+                    data[0] = timestamp+j*self.Nsamples/self.sample_rate
+                    data[1:] = means
+                    # Transfer data to queue and select what to plot
+                    self.q1.put(data)
+                    # Check if start button is press
+                    if self.newstart:
+                        # Write down unique identifier for first iteration
+                        self.dataLogger('# UUID: '+str(self.uuid),spaces = False)
+                        # Write down datalabels for first iteration
+                        self.dataLogger(self.plot_labels[:len(self.channels)+1])
+                        self.newstart = False
+                    # Write data to a file
+                    self.dataLogger(data)
+                    # Flush log file every 64 points
+                    if self.N % 64 == 0:
+                        self.flushLogFile()
+                    self.N+=1
+                # Flush log file also by time, so that slow measurements do not keep rows in buffer
+                if t1 >= next_flush:
+                    next_flush = t1+self.log_flush_interval
+                    self.flushLogFile()
+                # Construct metadata queue for the last point, UI only shows the latest
+                # values so updates are limited to its refresh rate
+                if t1 >= next_ui_update:
+                    next_ui_update = t1+self.ui_update_interval
+                    self.q2.put({"Npoints" : self.N-1, 
+                                 "Temperature": T, 
+                                 "Freq": "{:.2f} Hz".format(1.0/iter_time),
+                                 })
+                # Wait until deadline of the next iteration to keep steady cadence
+                next_deadline += self.wait_time
+                dt = next_deadline-time.perf_counter()
+                if dt > 0:
+                    time.sleep(dt)
+                else:
+                    # Iteration ran late, restart cadence from now instead of catching up
+                    next_deadline -= dt
+                # Calculate time per point
+                t2 = time.perf_counter()
+                iter_time = abs(t1-t2)/self.oversample
+        finally:
+            # Write buffered rows and close log file however the loop ends
+            self.closeLogFile()
+            # Release persistent DAQ task
+            self.daq.close_reader()
             
         # close plotting window at exit
         if self.closeAtExit:
@@ -217,11 +277,45 @@ class pyDAQmeas():
         '''
         print(self.channels)
         # Initialize array for data collection
-        self.out = np.empty(shape=(len(self.channels),self.Nsamples))
+        self.allocateOutput()
+        # Close task of the previous channel setup
+        if getattr(self,'daq',None) is not None:
+            self.daq.close_reader()
         # Initialize DAQ control class
         self.daq = DAQcontrol(self.channels)
+        # Compile reduction kernel before the measurement starts
+        batch_means(self.out.reshape(len(self.channels),self.oversample,self.Nsamples),self._means)
         self.setup_data_collection = False
         
+    def allocateOutput(self):
+        '''
+        Allocate DAQ output array for oversample x Nsamples samples per channel,
+        block means and data row for logging.
+        AnalogMultiChannelReader only reads into C-contiguous float64 arrays,
+        so the reductions work on float64 too
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.out = np.empty(shape=(len(self.channels),self.oversample*self.Nsamples),dtype=np.float64,order='C')
+        # Block means of channels and data row: time and channel means
+        self._means = np.empty((len(self.channels),self.oversample))
+        self._row = np.empty(len(self.channels)+1)
+        
+        
+    def setThermCalib(self):
+        '''
+        Select thermometer calibration function according to therm_calib_name,
+        dipstick calibration is used for unknown names
+
+        Returns
+        -------
+        None.
+
+        '''
+        self._therm_fn = self._THERM_FNS.get(self.therm_calib_name,calibration_dipstick_new)
         
     def processIncomingData(self):
         '''
@@ -252,10 +346,12 @@ class pyDAQmeas():
                 self.newstart = True
             if 'stop' in measParamDict:
                 self.start = False
+                self.flushLogFile()
                 
             # Get thermometer calibration from GUI
             if 'ThermCalibName' in measParamDict:
                 self.therm_calib_name = str(measParamDict['ThermCalibName'])
+                self.setThermCalib()
                 
             if 'ThermCh' in measParamDict:
                 self.Rtemp_ch = int(measParamDict['ThermCh'])
@@ -284,7 +380,7 @@ class pyDAQmeas():
             if 'Nsamples' in measParamDict:
                 self.Nsamples = int(measParamDict['Nsamples'])
                 # Update data array length accordingly
-                self.out = np.empty(shape=(len(self.channels),self.Nsamples))
+                self.allocateOutput()
                 print('Samples/point: ' + str(self.Nsamples))
                 
             print('===========================================================')
@@ -299,15 +395,79 @@ class pyDAQmeas():
         None.
 
         '''
+        if self.hdf5:
+            # Open HDF5 file on first write and whenever filename has changed
+            if self._h5 is None or self._h5.filename != self.fname+'.h5':
+                self.closeH5()
+                self._h5 = H5Logger(self.fname+'.h5')
+            self._h5.write(data)
+            return
+        # Open log file on first write and whenever filename has changed
+        if self._fh is None or self._fh.name != self.fname:
+            self.openLogFile()
         # write data to file
-        #self.fname = self.defaultpathname+"\\"+self.filename
-        with open(self.fname,'a+') as f:
-            if spaces:
-                f.write(" ".join(str(item) for item in data))
-                f.write("\n")
-            else:
-                f.write(data)
-                f.write("\n")
+        if isinstance(data,np.ndarray):
+            # Format numeric row with one printf-style call instead of str() per item
+            line = " ".join(["%.12g"]*data.size) % tuple(data.tolist())
+        elif spaces:
+            line = " ".join(map(str,data))
+        else:
+            line = data
+        self._fh.write((line+"\n").encode())
+        
+    def openLogFile(self):
+        '''
+        Open log file for appending with a 64 kB write buffer,
+        previously opened log file is closed
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.closeLogFile()
+        self._fh = open(self.fname,'ab',buffering=1<<16)
+        
+    def flushLogFile(self):
+        '''
+        Write buffered data to the log file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._fh is not None:
+            self._fh.flush()
+        if self._h5 is not None:
+            self._h5.flush()
+        
+    def closeLogFile(self):
+        '''
+        Flush and close the log file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self.closeH5()
+        
+    def closeH5(self):
+        '''
+        Flush and close the HDF5 file
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
     
     def Exit(self):
         '''
@@ -9,8 +9,11 @@ Warning: still under development
 @author: Aki Ruhtinas, aki.ruhtinas@gmail.com
 """
 import sys
+import os
+import time
 from UI.pyDAQ_UI_v2 import realTimeGraph
-from Control_lib.NiDAQmx_control import DAQcontrol
+from Control_lib.NiDAQmx_control import DAQcontrol, SharedBlockRing, PipeQueue
+from Control_lib.meas_utils import pinProcess, njit
 from Control_lib.instrument_control import *
 import nidaqmx
 from nidaqmx.constants import AcquisitionType ,LoggingMode, LoggingOperation, WaitMode
@@ -22,14 +25,98 @@ from PyQt5 import QtWidgets
 import numpy as np
 import multiprocessing as mp
 import traceback
+from queue import Empty
 import warnings
+import logging
 from pathlib import Path
 
 
+# Settings changes are logged at debug level, message is formatted only when enabled
+logger = logging.getLogger(__name__)
+
+# Default column labels, time and 19 channels
+DEFAULT_PLOT_LABELS = ('#Time(s)',) + tuple('Channel ' + str(i) for i in range(19))
+# Channel names used for testing without DAQ card
+TEST_CHANNEL_NAMES = ("Dev1/ai0","Dev1/ai1","Dev1/ai2","Dev1/ai3","Dev1/ai4","Dev1/ai5","Dev1/ai6","Dev1/ai7")
+
+
+@njit(nogil=True,fastmath=True,cache=True)
+def scale_block_means(block,timestamp,multips,row,rawdataout):
+    '''
+    Average DAQ block and scale with channel multipliers into one output row
+
+    Parameters
+    ----------
+    block : array
+        DAQ data, size (channels) x (samples)
+    timestamp : float
+        Time of the block
+    multips : array
+        Time and channel multipliers, size (channels+1)
+    row : array
+        Output row, size (channels+1) or 2*(channels)+1 with raw data
+    rawdataout : bool
+        Write unscaled means after the scaled data
+
+    Returns
+    -------
+    None.
+
+    '''
+    C = block.shape[0]
+    row[0] = timestamp*multips[0]
+    for c in range(C):
+        m = block[c].mean()
+        row[c+1] = m*multips[c+1]
+        if rawdataout:
+            row[C+1+c] = m
+
+
+@njit(nogil=True,fastmath=True,cache=True)
+def scale_block_samples(block,timestamp,time_offsets,multips,rows,rawdataout):
+    '''
+    Scale every sample of DAQ block with channel multipliers into output rows
+
+    Parameters
+    ----------
+    block : array
+        DAQ data, size (channels) x (samples)
+    timestamp : float
+        Time of the last sample
+    time_offsets : array
+        Time of each sample before the timestamp, size (samples)
+    multips : array
+        Time and channel multipliers, size (channels+1)
+    rows : array
+        Output rows, size (samples) x (channels+1) or 2*(channels)+1 with raw data
+    rawdataout : bool
+        Write unscaled samples after the scaled data
+
+    Returns
+    -------
+    None.
+
+    '''
+    C = block.shape[0]
+    rows[:,0] = (timestamp-time_offsets)*multips[0]
+    for c in range(C):
+        rows[:,c+1] = block[c]*multips[c+1]
+        if rawdataout:
+            rows[:,C+1+c] = block[c]
+
+
 class pyDAQmeas():
     '''
     Class for data acquisition
     '''
+    # Vectorized thermometer calibrations, called once per chunk with the whole column
+    # Currently available: [Dipstick','Morso','Ling','Kanada','Noiseless']
+    _THERM_FNS = {'Dipstick': tc.calibration_dipstick,
+                  'Morso': tc.calibration_morso_batch,
+                  'Ling': tc.calibration_Ling_batch,
+                  'Kanada': tc.calibration_Kanada_batch,
+                  }
+    
     def __init__(self):
         self.channels=["Dev1/ai0","Dev1/ai1","Dev1/ai2"]  # Channels to read
         self.Nsamples = 1000 # Number of samples per each point
@@ -54,6 +141,14 @@ class pyDAQmeas():
         
         self.chunk_averaging = True
         self.rawdataout = True
+        self.binary_log = False # Log float64 rows to fname+'.bin', header stays in fname
+        self.log_flush_interval = 0.2 # Maximum time logged data waits in memory
+        self.log_flush_size = 1<<20 # Logged data is written when this many bytes are buffered
+        self.log_fsync_interval = 5.0 # Time between forcing logged data to disk
+        # CPU cores for the measurement processes, None lets OS decide
+        self.process_cpus = {'DAQ':None,'processing':None,'logging':None}
+        self.daq_nice = None # Nice value for DAQ process on Unix, negative values need privileges
+        self.plot_float32 = False # Send plotted data as float32, halves data sent to UI but rounds time column
         
         self.uuid = uuid.uuid4()
                         
@@ -61,8 +156,7 @@ class pyDAQmeas():
         self.therm_multiplier = 1000
         self.thermCh = 0
 
-        self.plot_labels = ['Channel ' + str(i-1) for i in range(20)]
-        self.plot_labels[0] = '#Time(s)'
+        self.plot_labels = list(DEFAULT_PLOT_LABELS)
         self.plot_Vunit_multip = 1 # Unit volts
         self.plot_Iunit_multip = 1 # Unit amperes
         
@@ -71,12 +165,12 @@ class pyDAQmeas():
         self.Gv = 100
                 
         # Set up queues for communication
-        self.q0 = mp.Queue() # Queue for DAQ raw data
+        self.raw_ring = None # Shared memory ring for DAQ raw data, allocated at start
         self.q1 = mp.Queue() # Queue for data communication
-        self.q2 = mp.Queue() # Dictionary queue for metadata
+        self.q2 = PipeQueue() # Dictionary pipe for metadata
         self.q3 = mp.Queue() # Queue for data logging
-        self.qin = mp.Queue() # Queue to get data from UI
-        self.qr = mp.Queue() # Queue for communicating channel multipliers to measurement thread
+        self.qin = PipeQueue() # Pipe to get data from UI
+        self.qr = PipeQueue() # Pipe for communicating channel multipliers to measurement thread
         
         self.start = False
         
@@ -159,115 +253,156 @@ class pyDAQmeas():
         None.
 
         '''
-        while not self.start:
-            self.processIncomingMessages(stop_event)              
         self.N = 0
-        iter_time = 1
-        # Data handling and control loop
+        # Data handling and control loop, sleeps until UI sends a message
         while True:
             # Handle communication to main UI
-            self.processIncomingMessages(stop_event)
-            while not self.start:
-                self.processIncomingMessages(stop_event)
+            self.processIncomingMessages(stop_event,timeout=None)
         sys.exit()
         
         
-    def processIncomingMessages(self,stop_event):
+    def processIncomingMessages(self,stop_event,timeout=0.05):
         '''
         Method to process data sent by UI
         Changes Gv, Gi and Rtherm_multip when these are changed in UI
 
+        Parameters
+        ----------
+        stop_event : multiprocessing.Event
+            Event to stop data acquisition
+        timeout : float or None, optional
+            Maximum time to wait for the first message in seconds, None waits
+            until a message arrives. Waiting blocks on the pipe, so idle loops
+            calling this do not spin. The default is 0.05.
+
         Returns
         -------
         None.
 
         '''
+        # Wait for the first message
+        try:
+            measParamDict = self.qin.get(timeout=timeout)
+        except Empty:
+            return
         # Read if values are changed in UI
-        while not self.qin.empty():
-            # Extract data from queue
-            measParamDict = self.qin.get_nowait()
-            #print('===========================================================')
-            if 'Gv' in measParamDict:
-                self.Gv = float(measParamDict['Gv'])
-                print('Preamplifier gain changed: Gv = ' + str(self.Gv))
-            if 'Gi' in measParamDict:
-                self.Gi = float(measParamDict['Gi'])
-                print('Preamplifier gain changed: Gi = ' + str(self.Gi))
-            if 'Rtherm_multip' in measParamDict:
-                self.therm_multiplier = float(measParamDict['Rtherm_multip'])
-                print('Resistance bridge multiplier changed: Multiplier = ' + str(self.therm_multiplier))
-            if 'start' in measParamDict:
-                self.start = True
-                self.newstart = True
-                # Clear the stop event 
-                stop_event.clear()
-                self.startEvent(stop_event)
-                
-            if 'stop' in measParamDict:
-                self.start = False
-                # Set stop event flag
-                stop_event.set()
-                
-            # Get thermometer calibration from GUI
-            if 'ThermCalibName' in measParamDict:
-                print(f'Calibration changed to {self.therm_calib_name}')
-                self.therm_calib_name = str(measParamDict['ThermCalibName'])
-                
-            if 'ThermCh' in measParamDict:
-                self.thermCh = int(measParamDict['ThermCh'])
-                
-            # Get filename from GUI
-            if 'fname' in measParamDict:
-                self.fname = str(measParamDict['fname'])
-                print(self.fname)
-            
-            # Change sample rate on the fly
-            if 'SampleRate' in measParamDict:
-                self.sample_rate = int(measParamDict['SampleRate'])
-                print('Sample rate: ' + str(self.sample_rate))
-
-            # Change amount of points collected before written into file
-            if 'Nlogging' in measParamDict:
-                self.N_logging = int(measParamDict['Nlogging'])
-                print('Sample rate: ' + str(self.N_logging))
-
-            if 'measChannels' in measParamDict:
-                # Read channels from dictionary
-                self.channels = measParamDict['measChannels']
-                # Initialize multipliers
-                self.multips = np.ones(len(self.channels)+1)
-                # Setup flag to update data collection
-                self.setup_data_collection =True
-                
-            if 'datalabels' in measParamDict:
-                # Setup channel names
-                self.plot_labels = measParamDict['datalabels']
-                
-            # Check thermometer calibration name
-            if 'ThermCalibName' in measParamDict:
-                self.therm_calib_name = measParamDict['ThermCalibName']
-                
-            # Change samples/point on the fly
-            if 'Nsamples' in measParamDict:
-                self.Nsamples = int(measParamDict['Nsamples'])
-                # Update data array length accordingly
-                self.out = np.empty(shape=(len(self.channels),self.Nsamples))
-                print('Samples/point: ' + str(self.Nsamples))
-            
-            if 'SettingDict' in measParamDict:
-                # Get parameters from input dictionary
-                setdict = measParamDict['SettingDict']
-                setting_chi = setdict['Settings']
-                multip_chi = setdict['Multiplier']
-                chi = setdict['Channel']
-                # Parse parameters to settingDict
-                self.settingDict[chi] = {'Multiplier' : multip_chi,'Settings' : setting_chi}
-                # Handle parameter change
-                self.handleSettingDictChange(chi)
-            # Get UUID for the measurement
-            if 'UUID' in measParamDict:
-                self.uuid = measParamDict['UUID']
+        while True:
+            # Start and stop are sent as plain strings
+            if isinstance(measParamDict,str):
+                measParamDict = {measParamDict:None}
+            # Call handler of each key, unknown keys are ignored
+            for key,value in measParamDict.items():
+                handler = self._MESSAGE_HANDLERS.get(key)
+                if handler is not None:
+                    handler(self,value,stop_event)
+            # Extract rest of the messages from queue without waiting
+            try:
+                measParamDict = self.qin.get_nowait()
+            except Empty:
+                return
                 
+    def setGv(self,value,stop_event):
+        '''UI message: preamplifier voltage gain'''
+        self.Gv = float(value)
+        logger.debug('Preamplifier gain changed: Gv = %s',self.Gv)
+        
+    def setGi(self,value,stop_event):
+        '''UI message: preamplifier current gain'''
+        self.Gi = float(value)
+        logger.debug('Preamplifier gain changed: Gi = %s',self.Gi)
+        
+    def setThermMultiplier(self,value,stop_event):
+        '''UI message: resistance bridge multiplier'''
+        self.therm_multiplier = float(value)
+        logger.debug('Resistance bridge multiplier changed: Multiplier = %s',self.therm_multiplier)
+        
+    def startMeasurement(self,value,stop_event):
+        '''UI message: start measurement'''
+        self.start = True
+        self.newstart = True
+        # Clear the stop event 
+        stop_event.clear()
+        self.startEvent(stop_event)
+        
+    def stopMeasurement(self,value,stop_event):
+        '''UI message: stop measurement'''
+        self.start = False
+        # Set stop event flag
+        stop_event.set()
+        
+    def setThermCalibName(self,value,stop_event):
+        '''UI message: thermometer calibration'''
+        self.therm_calib_name = str(value)
+        logger.debug('Calibration changed to %s',self.therm_calib_name)
+        
+    def setThermCh(self,value,stop_event):
+        '''UI message: thermometer channel'''
+        self.thermCh = int(value)
+        
+    def setFilename(self,value,stop_event):
+        '''UI message: data file name'''
+        self.fname = str(value)
+        
+    def setSampleRate(self,value,stop_event):
+        '''UI message: DAQ sample rate'''
+        self.sample_rate = int(value)
+        logger.debug('Sample rate: %s',self.sample_rate)
+        
+    def setNlogging(self,value,stop_event):
+        '''UI message: number of points collected before written into file'''
+        self.N_logging = int(value)
+        logger.debug('Points per chunk: %s',self.N_logging)
+        
+    def setChannels(self,value,stop_event):
+        '''UI message: measured channels'''
+        # Read channels from dictionary
+        self.channels = value
+        # Initialize multipliers
+        self.multips = np.ones(len(self.channels)+1)
+        # Setup flag to update data collection
+        self.setup_data_collection = True
+        
+    def setDataLabels(self,value,stop_event):
+        '''UI message: channel names'''
+        self.plot_labels = value
+        
+    def setNsamples(self,value,stop_event):
+        '''UI message: samples per point'''
+        self.Nsamples = int(value)
+        logger.debug('Samples/point: %s',self.Nsamples)
+        
+    def setSettingDict(self,value,stop_event):
+        '''UI message: channel settings'''
+        # Get parameters from input dictionary
+        setting_chi = value['Settings']
+        multip_chi = value['Multiplier']
+        chi = value['Channel']
+        # Parse parameters to settingDict
+        self.settingDict[chi] = {'Multiplier' : multip_chi,'Settings' : setting_chi}
+        # Handle parameter change
+        self.handleSettingDictChange(chi)
+        
+    def setUUID(self,value,stop_event):
+        '''UI message: unique identifier of the measurement'''
+        self.uuid = value
+        
+    # Handler for each UI message key
+    _MESSAGE_HANDLERS = {'Gv': setGv,
+                         'Gi': setGi,
+                         'Rtherm_multip': setThermMultiplier,
+                         'start': startMeasurement,
+                         'stop': stopMeasurement,
+                         'ThermCalibName': setThermCalibName,
+                         'ThermCh': setThermCh,
+                         'fname': setFilename,
+                         'SampleRate': setSampleRate,
+                         'Nlogging': setNlogging,
+                         'measChannels': setChannels,
+                         'datalabels': setDataLabels,
+                         'Nsamples': setNsamples,
+                         'SettingDict': setSettingDict,
+                         'UUID': setUUID,
+                         }
                          
     def handleSettingDictChange(self,channel):
         '''
@@ -283,17 +418,15 @@ class pyDAQmeas():
         None.
 
         '''
-        # Add 1 here because time is never multiplied
-        self.multips = [1]
+        # First multiplier is 1 here because time is never multiplied
+        self.multips = np.ones(len(self.channels)+1)
         # Iterate through the channels and extract channel multipliers
-        for chi in self.channels:
-            try:
-                multip_chi = self.settingDict[chi]['Multiplier']
-            except:
-                multip_chi = 1
-            self.multips.append(multip_chi)
-        # Communicate channel multiplier to measurement thread
-        self.qr.put(self.multips)
+        for i,chi in enumerate(self.channels,1):
+            self.multips[i] = self.settingDict.get(chi,{}).get('Multiplier',1)
+        # Communicate channel multiplier to measurement thread, when stopped
+        # the next measurement starts with self.multips
+        if self.start:
+            self.qr.put(self.multips)
         
         # Communicate device settings to the device
         if self.settingDict[channel]['Settings']['Remote']:
@@ -321,6 +454,36 @@ class pyDAQmeas():
                         warnings.warn('Not able to connect to AVS-47')
         
             
+    def makeBlockWriter(self):
+        '''
+        Select function that writes one DAQ block into output chunk for the
+        current averaging, raw data and sampling settings, so that the
+        processing loop does not check the settings for every block.
+
+        Returns
+        -------
+        block_rows : int
+            Number of output rows from one block
+        write_block : function
+            Called as write_block(block,timestamp,multips,dataout,n_out) to
+            write block number n_out of the chunk into dataout
+
+        '''
+        rawdataout = self.rawdataout
+        if self.chunk_averaging:
+            block_rows = 1
+            def write_block(block,timestamp,multips,dataout,n_out):
+                scale_block_means(block,timestamp,multips,dataout[n_out],rawdataout)
+        else:
+            block_rows = self.Nsamples
+            # Time of each sample relative to the timestamp. Startpoint is the timestamp point
+            # and not hardware time, expect small deviation from real value
+            time_offsets = (np.arange(self.Nsamples,dtype=np.float64)*(1.0/self.sample_rate))[::-1]
+            def write_block(block,timestamp,multips,dataout,n_out):
+                scale_block_samples(block,timestamp,time_offsets,multips,
+                                    dataout[n_out*block_rows:(n_out+1)*block_rows],rawdataout)
+        return block_rows, write_block
+        
     def processData(self,stop_event,q0,q1,q3,qr):
         '''
         process measured data and send it forward
@@ -330,96 +493,132 @@ class pyDAQmeas():
         None.
 
         '''
-        # Initialize data arrays
-        if self.chunk_averaging:
-            output = np.zeros(shape=(self.N_logging,len(self.channels)+1))
-        else:
-            output = np.zeros(shape=(self.N_logging*self.Nsamples,len(self.channels)+1))
+        ncols = len(self.channels)+1
+        # Block writer for this configuration, selected once
+        block_rows, write_block = self.makeBlockWriter()
+        # Width of output, raw data without multiplication is added after the multiplied data
+        width = 2*ncols-1 if self.rawdataout else ncols
+        # Settings and methods used in the loop are bound to locals once
+        N_logging = self.N_logging
+        plot_float32 = self.plot_float32
+        q0_get = q0.get
+        q0_done = q0.task_done
+        # Blocks dropped by DAQ because processing fell behind, reported when count changes
+        overruns = q0.overruns.value
         # Infinite loop
-        multips = self.multips
-        print(multips)
-        # Select calibration function
-        # Currently available: [Dipstick','Morso','Ling','Kanada','Noiseless']
-        if self.therm_calib_name == 'Dipstick':
-            self.therm_calib = tc.calibration_dipstick
-        elif self.therm_calib_name == 'Morso':
-            self.therm_calib = tc.calibration_morso
-        elif self.therm_calib_name == 'Ling':
-            self.therm_calib = tc.calibration_Ling
-        elif self.therm_calib_name == 'Kanada':
-            self.therm_calib = tc.calibration_Kanada
-        else:
-            self.therm_calib = lambda x:x
+        multips = np.asarray(self.multips,dtype=np.float64)
+        logger.debug('Channel multipliers: %s',multips)
+        # Select calibration function, None when data is not calibrated
+        therm_calib = self._THERM_FNS.get(self.therm_calib_name)
         # Column where thermometer data is
         thermcol = self.thermCh + 1
         # Start while loop
         while not stop_event.is_set():
             # Read channel multipliers and get only the latest one
-            while not self.qr.empty() and not stop_event.is_set():
-                multips = self.qr.get_nowait()
+            try:
+                while True:
+                    multips = qr.get_nowait()
+            except Empty:
+                pass
+            # Allocate output chunk, queue pickles it after put returns so it cannot be reused
+            dataout = np.empty((N_logging*block_rows,width))
+            outputm = dataout[:,:ncols]
             # Read channel measurement data
             n_out = 0
             # Take data out of DAQ until desired amount of data is fetched
-            while n_out < self.N_logging and not stop_event.is_set():
-                # Take all the data from queue
+            while n_out < N_logging and not stop_event.is_set():
+                # Wait for data from DAQ, timeout lets the loop check stop event
                 try:
-                    rawdataout = self.q0.get_nowait()
-                except:
+                    timestamp, out = q0_get(timeout=0.05)
+                except Empty:
                     continue
-                timestamp = rawdataout[0]
-                out = rawdataout[1]
-                # Calculate average for each channel
-                if self.chunk_averaging:
-                    # Add one row to output array
-                    output[n_out] = np.concatenate(([timestamp],np.average(out, axis=1)))
-                else:
-                    # Generate time array. Startpoint is the timestamp point and not hardware time, expect small deviation from real value
-                    timearr = timestamp - np.linspace(0,(1/self.sample_rate)*(self.Nsamples-1),self.Nsamples)
-                    # Add time as a first channel and put data to output array
-                    output[n_out*self.Nsamples:(n_out+1)*self.Nsamples] = np.transpose(np.concatenate(([timearr[::-1]],out)))
+                # Average and multiply with channel multipliers directly into output rows
+                write_block(out,timestamp,multips,dataout,n_out)
+                # Block has been copied to output, DAQ can reuse its slot
+                q0_done()
                 n_out += 1
-            
-            # Multiply output with channel multipliers
-            outputm = np.multiply(output,multips)
+            # Chunk interrupted by stop is sent only up to the collected rows
+            if n_out < N_logging:
+                if n_out == 0:
+                    continue
+                dataout = dataout[:n_out*block_rows]
+                outputm = dataout[:,:ncols]
             # Apply thermometer function to only one column of the data
-            if self.therm_calib_name != 'None':
+            if therm_calib is not None:
                 try:
-                    outputm[:,thermcol] = np.apply_along_axis(self.therm_calib, 0, outputm[:,thermcol])
+                    outputm[:,thermcol] = therm_calib(outputm[:,thermcol])
                 except:
                     print('ERROR in temperature calculation')
-            # Send data to datalogging queue with raw data without multiplication
-            if self.rawdataout:
-                # Add raw data to output
-                dataout = np.concatenate((outputm,np.delete(output,0,axis=1)),axis=1)
-            else:
-                dataout = outputm
+            if q0.overruns.value != overruns:
+                logger.warning('Processing fell behind, %s DAQ blocks dropped from data',
+                               q0.overruns.value-overruns)
+                overruns = q0.overruns.value
             # Send data to logging queue
             q3.put(dataout)
             # Send multiplied data to plotting queue
-            q1.put(dataout) #!!! Averaging again for plotting!
-        print('Data processing stopped')
+            if plot_float32:
+                q1.put(dataout.astype(np.float32))
+            else:
+                q1.put(dataout) #!!! Averaging again for plotting!
+        print('Data processing stopped, dropped DAQ blocks: '+str(q0.overruns.value))
         sys.exit()
             
     def dataLogger(self,stop_event,q3):
         '''
-        Log data to file in own process
+        Log data to file in own process. Data chunks are formatted into an
+        in-memory buffer, as text or as raw float64 rows to fname+'.bin' when
+        binary_log is set, and the buffer is written to the file with one call
+        when log_flush_size bytes are collected or log_flush_interval has
+        passed. File is synced to disk every log_fsync_interval seconds.
+        Queue is drained before stopping.
 
         Returns
         -------
         None.
 
         '''
-        while not stop_event.is_set():
-            # Iterate data queue until empty
-            while not self.q3.empty():
-                # Get data from measurement thread
-                data = self.q3.get_nowait()
-                # write data to file
-                with open(self.fname,'a+') as f:
-                    # Write every row in data
-                    for di in data:
-                        f.write(" ".join(str(item) for item in di))
-                        f.write("\n")
+        if self.binary_log:
+            f = open(self.fname+'.bin','ab')
+        else:
+            f = open(self.fname,'ab')
+        buf = bytearray()
+        # Bytes format for one row, cached for the data width
+        ncols = None
+        last_flush = last_fsync = time.monotonic()
+        try:
+            while True:
+                # Wait for data from processing thread instead of polling the queue
+                try:
+                    data = q3.get(timeout=self.log_flush_interval)
+                except Empty:
+                    data = None
+                    if stop_event.is_set():
+                        break
+                if data is not None:
+                    # Format data chunk into buffer
+                    if self.binary_log:
+                        buf += np.asarray(data,dtype=np.float64).tobytes()
+                    else:
+                        if data.shape[1] != ncols:
+                            ncols = data.shape[1]
+                            row_fmt = b' '.join([b'%.12g']*ncols)+b'\n'
+                        buf += (row_fmt*data.shape[0]) % tuple(data.ravel().tolist())
+                # Write buffer when it is large enough or old enough
+                now = time.monotonic()
+                if buf and (len(buf) >= self.log_flush_size or now-last_flush >= self.log_flush_interval):
+                    f.write(buf)
+                    f.flush()
+                    buf.clear()
+                    last_flush = now
+                    if now-last_fsync >= self.log_fsync_interval:
+                        os.fsync(f.fileno())
+                        last_fsync = now
+        finally:
+            # Write remaining data
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
         print('Logging stopped')
         sys.exit()
             
@@ -445,29 +644,58 @@ class pyDAQmeas():
                 for chi in self.channels:
                     f.write(chi + " ")
             f.write("\n")
+        # Compile block kernel and calibration before data starts so first chunk is not delayed
+        block_rows, write_block = self.makeBlockWriter()
+        write_block(np.zeros((len(self.channels),self.Nsamples)),0.0,np.ones(len(self.channels)+1),
+                    np.empty((block_rows,2*len(self.channels)+1)),0)
+        if self.therm_calib_name in self._THERM_FNS:
+            with warnings.catch_warnings(), np.errstate(all='ignore'):
+                warnings.simplefilter('ignore')
+                self._THERM_FNS[self.therm_calib_name](np.full(self.N_logging,1000.0))
         # Start data collection
         
         # Initialize DAQ control class
         daq = DAQcontrol(self.channels)
 
+        # Allocate ring for raw DAQ data, shared memory of the previous run is freed
+        if self.raw_ring is not None:
+            self.raw_ring.release()
+        self.raw_ring = SharedBlockRing((len(self.channels),self.Nsamples))
+
         # Clear data queues:
-        while not self.q0.empty():
-            self.q0.get_nowait()
-        while not self.q3.empty():
-            self.q3.get_nowait()
+        try:
+            while True:
+                self.q3.get_nowait()
+        except Empty:
+            pass
+        # Multipliers left from previous measurement are older than self.multips
+        try:
+            while True:
+                self.qr.get_nowait()
+        except Empty:
+            pass
 
         # Start logging data to multiprocessing queue continuously
-        measData = mp.Process(target = daq.continous_Nread,args = (stop_event,self.q0,self.sample_rate, self.Nsamples))
+        measData = mp.Process(target = daq.continous_Nread,args = (stop_event,self.raw_ring,self.sample_rate, self.Nsamples))
         measData.start()
+        pinProcess(self.process_cpus.get('DAQ'),measData.pid,'DAQ')
+        # Raise DAQ process priority so that reads are not delayed by other processes
+        if self.daq_nice is not None and hasattr(os,'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS,measData.pid,self.daq_nice)
+            except OSError as e:
+                print('Could not set DAQ process priority: '+str(e))
         print('Data logging started')
         # Start processing thread
-        proData = mp.Process(target = self.processData,args = (stop_event,self.q0,self.q1,self.q3,self.qr))
+        proData = mp.Process(target = self.processData,args = (stop_event,self.raw_ring,self.q1,self.q3,self.qr))
         proData.start()
+        pinProcess(self.process_cpus.get('processing'),proData.pid,'processing')
         print('Data processing started')
         
         # Data logging thread
         logData = mp.Process(target = self.dataLogger,args = (stop_event,self.q3))
         logData.start()
+        pinProcess(self.process_cpus.get('logging'),logData.pid,'logging')
         print('Data writing to file started')
             
             
@@ -517,7 +745,7 @@ def getChannelNames(name):
         DESCRIPTION.
 
     '''
-    return ["Dev1/ai0","Dev1/ai1","Dev1/ai2","Dev1/ai3","Dev1/ai4","Dev1/ai5","Dev1/ai6","Dev1/ai7"]
+    return list(TEST_CHANNEL_NAMES)
         
 if __name__ == '__main__':
         # Initialize class
@@ -15,8 +15,151 @@ import time
 import multiprocessing as mp
 import traceback
 import datetime
+import warnings
+from queue import Empty
+from collections import deque
+
+
+def rowsToArray(rows):
+    '''
+    Convert list of data rows to 2D array, rows of different length are
+    padded with NaN to the length of the longest row
+
+    Parameters
+    ----------
+    rows : list
+        Data rows
+
+    Returns
+    -------
+    array
+        Rows as float64 array
+
+    '''
+    try:
+        return np.asarray(rows,dtype=np.float64)
+    except ValueError:
+        width = max(len(row) for row in rows)
+        out = np.full((len(rows),width),np.nan)
+        for i,row in enumerate(rows):
+            out[i,:len(row)] = row
+        return out
+
+
+def readQueueBatch(queue,max_batch):
+    '''
+    Read at most max_batch items from queue
+
+    Parameters
+    ----------
+    queue : Queue
+        Incoming data queue, mp.Queue or SharedRingQueue
+    max_batch : int
+        Maximum number of queue items read
+
+    Returns
+    -------
+    list
+        New data arrays, 'Exit' as last item if exit message was received
+
+    '''
+    out = []
+    if hasattr(queue,'get_many'):
+        # Shared memory ring gives all new rows as one array
+        rows = queue.get_many(max_batch)
+        if rows.shape[0]:
+            out.append(rows)
+            max_batch -= rows.shape[0]
+    batch = []
+    for k in range(max_batch):
+        try:
+            data_in=queue.get_nowait()
+        except Empty:
+            break
+        if data_in == 'Exit':
+            if batch:
+                out.append(rowsToArray(batch))
+            out.append('Exit')
+            return out
+        batch.append(data_in)
+    if batch:
+        out.append(rowsToArray(batch))
+    return out
+
+
+class DataFetcher(QtCore.QThread):
+    '''
+    Worker thread reading the data queue outside of the GUI thread
+    '''
+
+    def __init__(self, queue, max_batch=10000, idle_ms=5, parent=None):
+        '''
+        Initialize worker
+
+        Parameters
+        ----------
+        queue : Queue
+            Incoming data queue, mp.Queue or SharedRingQueue
+        max_batch : int, optional
+            Maximum number of queue items read in one batch. The default is 10000.
+        idle_ms : int, optional
+            Sleep time when queue is empty. The default is 5.
+        parent : QObject, optional
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        '''
+        super().__init__(parent)
+        self.queue = queue
+        self.max_batch = max_batch
+        self.idle_ms = idle_ms
+        # Batches are handed to the GUI thread through deque, which is thread safe
+        # for append and popleft. Each batch is a new array so GUI never sees
+        # partially written data.
+        self.batches = deque()
+        self.running = True
+
+    def run(self):
+        '''
+        Read queue until stopped or exit message is received
+
+        Returns
+        -------
+        None.
+
+        '''
+        while self.running:
+            try:
+                out = readQueueBatch(self.queue,self.max_batch)
+            except Exception:
+                # Bad item must not stop the thread and plotting with it
+                traceback.print_exc()
+                self.msleep(self.idle_ms)
+                continue
+            if not out:
+                self.msleep(self.idle_ms)
+                continue
+            self.batches.extend(out)
+            if isinstance(out[-1],str):
+                break
+        self.running = False
+
+    def stop(self):
+        '''
+        Stop worker and wait for it to finish
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.running = False
+        self.wait()
+
 
-        
 class realTimeGraph(QtWidgets.QMainWindow):
     '''
     Python GUI for fast and efficient real time data plotting
@@ -254,6 +397,13 @@ class realTimeGraph(QtWidgets.QMainWindow):
         
         self.plots=[]
         self.curves=[]
+        # Channel plots and curves by channel index, kept when hidden
+        self.channelPlots={}
+        # Channel plots scaled by renderPlots, plots zoomed by user are left out
+        self.autoRangePlots=set()
+        # Channel plot ranges are updated every autorange_interval redraws
+        self.autorange_interval = 10
+        self.Nrender = 0
                 
         self.mainPlt=None
         self.mainCrv=None
@@ -261,9 +411,25 @@ class realTimeGraph(QtWidgets.QMainWindow):
         self.mainX=0
         self.mainY=1
         
-        # Initialize arrays for data collection
-        self.data  = [ [] for y in range(self.Nchannel+1)]
+        # Initialize arrays for data collection, one row per channel and one
+        # column per point. Buffer grows by doubling up to twice the number of
+        # points allowed by memory_limit (bytes of float64 data), after that
+        # oldest points are dropped
+        if np.isinf(self.memory_limit):
+            self.capacity = None
+        else:
+            self.capacity = max(int(self.memory_limit/(8*(self.Nchannel+1))),1)
+        self.data = np.empty((self.Nchannel+1,1024))
+        self.Ndata = 0
+        # Maximum number of queue items read per batch, keeps UI responsive
+        self.max_batch = 10000
+        # Queue is read in DataFetcher thread, set False to read in GUI thread
+        self.background_fetch = True
+        self.fetcher = None
+        # Plots are redrawn when new data arrives or when this flag is set
+        self.plotsDirty = True
         self.scrollN = 1000
+        self.scrolling = False # Rolling plot state, follows scrollRadio
         self.t=[]
         self.Npoint=0
         
@@ -282,6 +448,12 @@ class realTimeGraph(QtWidgets.QMainWindow):
         # Set event timers
         self.timer=pg.QtCore.QTimer()
         self.timer.timeout.connect(self.updatePlots)
+        # Setting changes are collected and sent together after the last change
+        self.pendingSettings = {}
+        self.settingsTimer=pg.QtCore.QTimer()
+        self.settingsTimer.setSingleShot(True)
+        self.settingsTimer.setInterval(150)
+        self.settingsTimer.timeout.connect(self.sendSettings)
         
         # Set boolean value for m
         self.start = False
@@ -578,6 +750,8 @@ class realTimeGraph(QtWidgets.QMainWindow):
             # Get filename if filename is empty or not temporary file
             if self.fname == None or self.fname.split('/')[-1].lower() not in ['temp.data','temp.dat','temp.txt','test.dat','test.data']:
                 self.fname = QtWidgets.QFileDialog.getSaveFileName(self, 'Save file', self.filepath,"")[0]
+            # Send pending setting changes before measurement starts
+            self.sendSettings()
             # Put filename to output Queue
             self.qout.put({'fname':self.fname})
             # Check and initialize file
@@ -612,30 +786,28 @@ class realTimeGraph(QtWidgets.QMainWindow):
         None.
 
         '''
-        self.selected_channels_plotted = []
+        selected = []
         # Get channels names for all the selected channels
         i = 1
         for ach in self.actionChsp:
             if ach.isChecked():
-                self.selected_channels_plotted.append(i)
+                selected.append(i)
             i+=1
-        #print(self.selected_channels)
+        # Nothing to do if selection did not change
+        if selected == self.selected_channels_plotted:
+            return
+        self.selected_channels_plotted = selected
         
-        # Remove old channel plots
-        for row in range(0,self.Nchannel_plotted):
-            item = self.win.getItem(row, 0)
-            if item!= None:
-                self.win.removeItem(item)
+        # Take shown channel plots out of the layout, plots are kept for reuse
+        for pi in self.plots:
+            self.win.removeItem(pi)
                         
         # Update channel count
         self.Nchannel_plotted = len(self.selected_channels_plotted)
         
-        # Reset plots and curves
-        self.plots = []
-        self.curves = []
-        
-        # Draw channel plots again
+        # Place selected channel plots again
         self.addChannelPlots()
+        self.plotsDirty = True
         
         
         
@@ -669,6 +841,7 @@ class realTimeGraph(QtWidgets.QMainWindow):
 
         '''
         self.scrollN = self.scrollNSpin.value()
+        self.plotsDirty = True
         
         
     def spinNsamplesChanged(self):
@@ -681,7 +854,7 @@ class realTimeGraph(QtWidgets.QMainWindow):
 
         '''
         self.dataNsamples = self.spinNsamples.value()
-        self.qout.put({'Nsamples':self.dataNsamples})
+        self.queueSettings({'Nsamples':self.dataNsamples})
         
         
         
@@ -695,7 +868,7 @@ class realTimeGraph(QtWidgets.QMainWindow):
 
         '''
         self.dataSampleRate = self.spinSampleRate.value()
-        self.qout.put({'SampleRate':self.dataSampleRate})
+        self.queueSettings({'SampleRate':self.dataSampleRate})
         
         
     def autosensClicked(self):
@@ -723,13 +896,15 @@ class realTimeGraph(QtWidgets.QMainWindow):
         None.
 
         '''
-        # ScrollRadio
-        if self.scrollRadio.isChecked():
+        # ScrollRadio, state is stored so that plotting does not query the widget
+        self.scrolling = self.scrollRadio.isChecked()
+        if self.scrolling:
             self.scrollNLabel.setStyleSheet('QLabel {color: white;}')
             self.scrollNSpin.setReadOnly(False)
         else:
             self.scrollNLabel.setStyleSheet('QLabel {color: dimgrey;}')
             self.scrollNSpin.setReadOnly(True)
+        self.plotsDirty = True
 
         
     def setDataQueue(self,dataQueue, dictQueue, qout):
@@ -761,7 +936,8 @@ class realTimeGraph(QtWidgets.QMainWindow):
     
     def addChannelPlots(self):
         '''
-        Adds channel plots to UI
+        Adds plots of selected channels to UI. Plots created earlier are
+        placed back to the layout instead of creating them again
 
         Returns
         -------
@@ -770,15 +946,30 @@ class realTimeGraph(QtWidgets.QMainWindow):
         '''
         k=0
         j=0
+        self.plots = []
+        self.curves = []
         for i in range(0,self.Nchannel):
             if i not in self.selected_channels_plotted:
                 continue
+            if i in self.channelPlots:
+                # Reuse existing plot
+                pi,ci = self.channelPlots[i]
+                self.win.addItem(pi,row=k,col=j)
+                self.plots.append(pi)
+                self.curves.append(ci)
+                k+=1
+                continue
             # Add plot to specific place in the window
             pi = self.win.addPlot(row=k, col=j)
             # Use automatic downsampling and clipping to reduce the drawing load
             pi.setDownsampling(mode='peak')
             # Attempt to draw only points within the visible range of the ViewBox.
             pi.setClipToView(True)
+            # Range is set by renderPlots at a lower rate than drawing, until
+            # user zooms or pans the plot
+            pi.enableAutoRange(False)
+            self.autoRangePlots.add(pi)
+            pi.getViewBox().sigRangeChangedManually.connect(lambda *args,pi=pi: self.autoRangePlots.discard(pi))
             
             # Set labels for the plots
             self.label_style = {'color': '#EEE', 'font-size': '10pt'}
@@ -791,6 +982,7 @@ class realTimeGraph(QtWidgets.QMainWindow):
             #Add plots and curves to array for easy handling
             self.plots.append(pi)
             self.curves.append(ci)
+            self.channelPlots[i] = (pi,ci)
             k+=1
             
             
@@ -831,43 +1023,12 @@ class realTimeGraph(QtWidgets.QMainWindow):
         None.
 
         '''
-        i=0
         try:
-            # Extract all the data from queue
-            while not self.queue.empty():
-                # Extract data from queue
-                data_in=self.queue.get_nowait()
-                self.Ndata_in = len(data_in) # Get length of incoming data
-                if data_in == 'Exit':
-                    self.close()
-                    sys.exit()
-                j=0
-                # Add data to data array and check for size limit
-                datacount = sys.getsizeof(self.data[0]*len(self.data))
-                if datacount > self.memory_limit:
-                    for di in data_in:
-                        self.data[j].pop(0)
-                        self.data[j].append(di)
-                        j+=1
-                else:
-                    for di in data_in:
-                        self.data[j].append(di)
-                        j+=1
-            i=0
-            # Add data to channel plots
-            # Plot the data
-            for ci in self.curves:
-                if self.scrollRadio.isChecked():
-                    ci.setData(self.data[0][-self.scrollN:],self.data[self.selected_channels_plotted[i]][-self.scrollN:])
-                else:
-                    ci.setData(self.data[0],self.data[self.selected_channels_plotted[i]])
-                self.Npoint+=1
-                i+=1
-            # Add data to main plot
-            if self.scrollRadio.isChecked():
-                self.mainCrv.setData(self.data[self.mainX][-self.scrollN:],self.data[self.mainY][-self.scrollN:])
-            else:
-                self.mainCrv.setData(self.data[self.mainX],self.data[self.mainY])
+            # Redraw only when there is something new to show, so idle updates
+            # leave the event loop free for user input
+            if self.fetchData() or self.plotsDirty:
+                self.renderPlots()
+                self.plotsDirty = False
             
             # Update point count if that is provided via dictQueue
             params={}
@@ -885,8 +1046,8 @@ class realTimeGraph(QtWidgets.QMainWindow):
                         self.tempLabel.setText('Temperature: {T:.2f} K'.format(T=T))
                 if "Freq" in params:
                     self.freqLabel.setText('Sampling frequency: ' + str(params["Freq"]))
-                if len(self.data[0])>1:
-                   self.t_elapsedLabel.setText('Time elapsed: ' + str(datetime.timedelta(seconds=int(self.data[0][-1]))))
+                if self.Ndata>1:
+                   self.t_elapsedLabel.setText('Time elapsed: ' + str(datetime.timedelta(seconds=int(self.data[0,self.Ndata-1]))))
             except Exception as e:
                 traceback.print_exc()
                 
@@ -902,6 +1063,138 @@ class realTimeGraph(QtWidgets.QMainWindow):
             # Print full traceback for easier debugging
             traceback.print_exc()
          
+    def fetchData(self):
+        '''
+        Move data read by fetcher thread into data array, at most max_batch rows
+
+        Returns
+        -------
+        bool
+            True if new data was added
+
+        '''
+        if self.fetcher is None:
+            # No worker thread, read queue directly
+            batches = deque(readQueueBatch(self.queue,self.max_batch))
+        else:
+            batches = self.fetcher.batches
+        new_data = False
+        # At most max_batch rows are added per update, rest are left for next update
+        nrows = 0
+        while batches and nrows < self.max_batch:
+            data_in = batches.popleft()
+            if isinstance(data_in,str) and data_in == 'Exit':
+                self.stopFetcher()
+                self.close()
+                sys.exit()
+            self.Ndata_in = data_in.shape[1] # Get length of incoming data
+            self.appendData(data_in)
+            nrows += data_in.shape[0]
+            new_data = True
+        return new_data
+
+    def stopFetcher(self):
+        '''
+        Stop queue reader thread if running
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.fetcher is not None and QtCore.QThread.currentThread() is not self.fetcher:
+            self.fetcher.stop()
+        
+    def renderPlots(self):
+        '''
+        Draw data to channel plots and main plot
+
+        Returns
+        -------
+        None.
+
+        '''
+        # Plotted points are views to the data array, no copying
+        data = self.plotData()
+        x = data[0]
+        # Add data to channel plots
+        for ci,ch in zip(self.curves,self.selected_channels_plotted):
+            ci.setData(x,data[ch])
+        self.Npoint+=len(self.curves)
+        # Update channel plot ranges, scanning data every frame would make
+        # drawing cost grow with the number of points
+        if self.Nrender % self.autorange_interval == 0 and x.size:
+            # Channels without data are all NaN, skip them without warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore',RuntimeWarning)
+                xrange = (np.nanmin(x),np.nanmax(x))
+                for pi,ch in zip(self.plots,self.selected_channels_plotted):
+                    if pi in self.autoRangePlots:
+                        yrange = (np.nanmin(data[ch]),np.nanmax(data[ch]))
+                        if np.isfinite(xrange+yrange).all():
+                            pi.setRange(xRange=xrange,yRange=yrange)
+        self.Nrender += 1
+        # Add data to main plot
+        self.mainCrv.setData(data[self.mainX],data[self.mainY])
+        
+    def appendData(self,batch):
+        '''
+        Add points to the end of data array. Array is grown by doubling and
+        when memory limit is reached, oldest points are moved out so that
+        data stays contiguous and plots can use views to it.
+
+        Parameters
+        ----------
+        batch : array
+            New points, size (points) x (channels)
+
+        Returns
+        -------
+        None.
+
+        '''
+        n = batch.shape[0]
+        size = self.data.shape[1]
+        if self.Ndata+n > size:
+            # Grow array if memory limit allows
+            newsize = max(2*size,self.Ndata+n)
+            if self.capacity is not None:
+                newsize = min(newsize,2*self.capacity)
+            if newsize > size:
+                data = np.empty((self.data.shape[0],newsize))
+                data[:,:self.Ndata] = self.data[:,:self.Ndata]
+                self.data = data
+            # Drop oldest points so that at most capacity points remain
+            if self.Ndata+n > self.data.shape[1]:
+                if n > self.capacity:
+                    batch = batch[-self.capacity:]
+                    n = self.capacity
+                keep = min(self.Ndata,self.capacity-n)
+                self.data[:,:keep] = self.data[:,self.Ndata-keep:self.Ndata]
+                self.Ndata = keep
+        self.data[:batch.shape[1],self.Ndata:self.Ndata+n] = batch.T
+        # Channels missing from incoming data are not drawn
+        self.data[batch.shape[1]:,self.Ndata:self.Ndata+n] = np.nan
+        self.Ndata += n
+        
+    def plotData(self):
+        '''
+        Data to be plotted, last scrollN points for rolling plot and
+        last points allowed by memory limit otherwise
+
+        Returns
+        -------
+        array
+            View to the data array, size (channels) x (points)
+
+        '''
+        start = 0
+        if self.capacity is not None:
+            start = max(self.Ndata-self.capacity,0)
+        if self.scrolling and self.scrollN > 0:
+            start = max(self.Ndata-self.scrollN,start)
+        return self.data[:,start:self.Ndata]
+        
     def clearPlot(self):
         '''
         Method to clear plotting data, does not affect to collected data
@@ -911,7 +1204,9 @@ class realTimeGraph(QtWidgets.QMainWindow):
         None.
 
         '''
-        self.data = [ [] for y in range(self.Ndata_in)]
+        self.Ndata = 0
+        self.plotsDirty = True
+        self.Nrender = 0
         
     
     def changeLabels(self,labels):
@@ -962,7 +1257,40 @@ class realTimeGraph(QtWidgets.QMainWindow):
         self.Gv = self.combo_Gv_list[self.comboGv.currentIndex()]
         self.Gi = self.combo_Gi_list[self.comboGi.currentIndex()]
         self.Rtherm_multip = self.combo_Rtherm_multip_list[self.comboRtherm_multip.currentIndex()]
-        self.qout.put({'Gv':self.Gv,'Gi':self.Gi,'Rtherm_multip':self.Rtherm_multip})
+        self.queueSettings({'Gv':self.Gv,'Gi':self.Gi,'Rtherm_multip':self.Rtherm_multip})
+        
+    def queueSettings(self,settings):
+        '''
+        Collect setting changes, they are sent to measurement program in one
+        dictionary when no changes have been made for 150 ms
+
+        Parameters
+        ----------
+        settings : dict
+            Changed settings
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.pendingSettings.update(settings)
+        # Restart waiting time
+        self.settingsTimer.start()
+        
+    def sendSettings(self):
+        '''
+        Send collected setting changes to measurement program
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.settingsTimer.stop()
+        if self.pendingSettings:
+            self.qout.put(self.pendingSettings)
+            self.pendingSettings = {}
 
     def axisComboChanged(self,*args):
         '''
@@ -980,8 +1308,9 @@ class realTimeGraph(QtWidgets.QMainWindow):
         # Select data to be plotted for X and Y axis
         self.mainX = self.comboX.currentIndex()
         self.mainY = self.comboY.currentIndex()
-        # Indicate that labels need to be updated
+        # Indicate that labels and plots need to be updated
         self.labelChanged=True
+        self.plotsDirty = True
 
     def updateMainPlotLabels(self):
         '''
@@ -997,6 +1326,13 @@ class realTimeGraph(QtWidgets.QMainWindow):
         self.mainPlt.setLabel('left', self.combo_list[self.mainY], **self.mainlabel_style)
         
     def Run(self):
+        # Start reading the data queue in worker thread
+        if self.background_fetch and self.fetcher is None:
+            self.fetcher = DataFetcher(self.queue,max_batch=self.max_batch)
+            app = QtWidgets.QApplication.instance()
+            if app is not None:
+                app.aboutToQuit.connect(self.stopFetcher)
+            self.fetcher.start()
         # Start updating the plot
         self.timer.start(25)
         